@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+from __future__ import print_function, absolute_import, division
+import argparse
+import json
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import evaluation.evalInstanceLevelSemanticLabeling as cityscapes_eval
+from evaluate import evaluation_args, submission_args, get_ground_truth_list
+from preprocess_files import prepare_submitted_files
+
+STAGES = [
+    "prepare_submitted_files",
+    "getGtInstances",
+    "streamMatches",
+    "evaluateMatches",
+    "coco",
+]
+
+# label ids of the synthetic ground truth
+VOID_LABEL = 0  # unlabeled, ignored in evaluation
+ROAD_LABEL = 7
+ANOMALY_LABEL = 26
+
+
+def random_box(rng, height, width, max_size):
+    box_height = int(rng.integers(4, max_size))
+    box_width = int(rng.integers(4, max_size))
+    y = int(rng.integers(0, height - box_height))
+    x = int(rng.integers(0, width - box_width))
+    return y, x, box_height, box_width
+
+
+def generate_data(data_path, images, instances, predictions, height, width, seed):
+    # Cityscapes-style instance id maps and a submission in the txt format,
+    # plus the same instances as COCO bounding boxes
+    rng = np.random.default_rng(seed)
+    labels_path = data_path / "labels"
+    submit_path = data_path / "submission"
+    labels_path.mkdir(parents=True)
+    submit_path.mkdir(parents=True)
+    max_size = max(8, min(height, width) // 4)
+
+    coco_gt = {
+        "images": [],
+        "annotations": [],
+        "categories": [{"id": 1, "name": "anomaly"}],
+    }
+    coco_predictions = []
+    for i in range(images):
+        core = f"bench_{i:06d}_{i:06d}"
+        gt = np.full((height, width), ROAD_LABEL, dtype=np.int32)
+        gt[: height // 5] = VOID_LABEL
+        boxes = []
+        for j in range(instances):
+            y, x, box_height, box_width = random_box(rng, height, width, max_size)
+            gt[y : y + box_height, x : x + box_width] = ANOMALY_LABEL * 1000 + j + 1
+            boxes.append((y, x, box_height, box_width))
+        Image.fromarray(gt.astype(np.uint16)).save(
+            labels_path / f"{core}_gtCoarse_instanceIds.png"
+        )
+
+        coco_gt["images"].append(
+            {"id": i, "file_name": f"{core}.png", "height": height, "width": width}
+        )
+        for y, x, box_height, box_width in boxes:
+            coco_gt["annotations"].append(
+                {
+                    "id": len(coco_gt["annotations"]) + 1,
+                    "image_id": i,
+                    "category_id": 1,
+                    "bbox": [x, y, box_width, box_height],
+                    "area": box_width * box_height,
+                    "iscrowd": 0,
+                }
+            )
+
+        lines = []
+        for j in range(predictions):
+            if boxes and rng.random() < 0.7:
+                # a shifted ground truth instance
+                y, x, box_height, box_width = boxes[int(rng.integers(0, len(boxes)))]
+                y = int(np.clip(y + rng.integers(-3, 4), 0, height - box_height))
+                x = int(np.clip(x + rng.integers(-3, 4), 0, width - box_width))
+            else:
+                y, x, box_height, box_width = random_box(rng, height, width, max_size)
+            mask = np.zeros((height, width), dtype=np.uint8)
+            mask[y : y + box_height, x : x + box_width] = 255
+            name = f"{core}_gtCoarse_instanceIds_{j}_1.png"
+            Image.fromarray(mask).save(submit_path / name)
+            score = round(float(rng.random()), 3)
+            lines.append(f"{name} {ANOMALY_LABEL} {score}")
+            coco_predictions.append(
+                {
+                    "image_id": i,
+                    "category_id": 1,
+                    "bbox": [x, y, box_width, box_height],
+                    "score": score,
+                }
+            )
+        (submit_path / f"{core}_gtCoarse_instanceIds_pred.txt").write_text(
+            "\n".join(lines) + "\n"
+        )
+
+    with open(labels_path / "bench_label.json", "w") as f:
+        json.dump(coco_gt, f)
+    with open(submit_path / "bench.json", "w") as f:
+        json.dump(coco_predictions, f)
+    return labels_path, submit_path
+
+
+def run_stages(stages, labels_path, submit_path, tmp_path, workers):
+    # Every stage is a function that runs it once, with all inputs it needs
+    # already prepared by the stages before
+    args = submission_args(evaluation_args(labels_path, workers), submit_path)
+    args = args._replace(gtInstancesFile=str(tmp_path / "gtinstances.npz"))
+    gt_list = get_ground_truth_list(labels_path)
+    prediction_list = cityscapes_eval.getPredictions(gt_list, args)
+    state = {}
+
+    def prepare():
+        shutil.rmtree(tmp_path / "prepared", ignore_errors=True)
+        prepare_submitted_files(submit_path, tmp_path / "prepared")
+
+    def gt_instances():
+        # always measure a cold cache
+        Path(args.gtInstancesFile).unlink(missing_ok=True)
+        state["gtInstances"] = cityscapes_eval.getGtInstances(gt_list, args)
+
+    def match():
+        # the same matching and scoring as evaluate.py
+        if not "gtInstances" in state:
+            gt_instances()
+        state["matchTable"] = cityscapes_eval.streamMatches(
+            prediction_list, gt_list, state["gtInstances"], args
+        )
+
+    def evaluate_matches():
+        if not "matchTable" in state:
+            match()
+        cityscapes_eval.evaluateMatches(state["matchTable"], args)
+
+    def coco():
+        coco_evaluation(labels_path, submit_path)
+
+    functions = {
+        "prepare_submitted_files": prepare,
+        "getGtInstances": gt_instances,
+        "streamMatches": match,
+        "evaluateMatches": evaluate_matches,
+        "coco": coco,
+    }
+    return [(stage, functions[stage]) for stage in stages]
+
+
+def coco_evaluation(labels_path, submit_path):
+    import evaluate_detection
+    from evaluation.boxEvaluation import BoxDataset, BoxEval
+
+    gt_json_path = labels_path / "bench_label.json"
+    cocoGt = BoxDataset.fromFile(gt_json_path)
+    predictions = evaluate_detection.filter_files(
+        cocoGt.imgs, submit_path / "bench.json"
+    )
+    cocoDt = cocoGt.loadRes(predictions)
+    cocoEval = BoxEval(cocoGt, cocoDt)
+    cocoEval.evaluate()
+    cocoEval.accumulate()
+    cocoEval.summarize()
+    evaluate_detection.compute_classification_metrics(cocoGt, cocoEval, threshold=0.5)
+
+
+def measure(function, repeat):
+    # the fastest of all runs, and the peak of the traced allocations of one
+    # more run, since tracing slows everything down
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def compare(report, baseline, tolerance):
+    # the stages that got slower than the baseline by more than the tolerance
+    regressions = []
+    for stage, result in report["stages"].items():
+        if not stage in baseline.get("stages", {}):
+            continue
+        ratio = result["seconds"] / max(baseline["stages"][stage]["seconds"], 1e-9)
+        result["baseline_ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main(
+    images=50,
+    instances=5,
+    predictions=10,
+    height=512,
+    width=1024,
+    seed=0,
+    repeat=3,
+    workers=1,
+    stages=None,
+    baseline=None,
+    save_baseline=False,
+    tolerance=0.2,
+    output=None,
+):
+    stages = stages or STAGES
+
+    config = {
+        "images": images,
+        "instances": instances,
+        "predictions": predictions,
+        "height": height,
+        "width": width,
+        "seed": seed,
+        "repeat": repeat,
+        "workers": workers,
+    }
+    report = {"config": config, "stages": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        labels_path, submit_path = generate_data(
+            tmp_path / "data", images, instances, predictions, height, width, seed
+        )
+        for stage, function in run_stages(
+            stages, labels_path, submit_path, tmp_path, workers
+        ):
+            seconds, peak = measure(function, repeat)
+            report["stages"][stage] = {
+                "seconds": seconds,
+                "images_per_second": images / seconds if seconds else float("inf"),
+                "peak_memory_mb": peak / 2**20,
+            }
+
+    regressions = []
+    if baseline is not None and not save_baseline:
+        with open(baseline, "r") as f:
+            baseline_report = json.load(f)
+        if baseline_report.get("config") != config:
+            print("The baseline was measured with another configuration")
+        regressions = compare(report, baseline_report, tolerance)
+
+    print(f"{'stage':<26}{'seconds':>10}{'images/s':>12}{'peak MB':>10}{'vs base':>10}")
+    for stage, result in report["stages"].items():
+        ratio = result.get("baseline_ratio")
+        ratio = f"{ratio:.2f}x" if ratio is not None else "-"
+        print(
+            f"{stage:<26}{result['seconds']:>10.3f}{result['images_per_second']:>12.1f}"
+            f"{result['peak_memory_mb']:>10.1f}{ratio:>10}"
+        )
+    if regressions:
+        print(f"Slower than the baseline by more than {tolerance:.0%}: {', '.join(regressions)}")
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if save_baseline and baseline is not None:
+        with open(baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    return report, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the stages of the scoring pipeline on synthetic data"
+    )
+
+    parser.add_argument("--images", type=int, default=50, help="Number of images")
+    parser.add_argument("--instances", type=int, default=5, help="Ground truth instances per image")
+    parser.add_argument("--predictions", type=int, default=10, help="Predictions per image")
+    parser.add_argument("--height", type=int, default=512, help="Image height")
+    parser.add_argument("--width", type=int, default=1024, help="Image width")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest one is reported")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for matching")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, help="Stages to run, all by default")
+    parser.add_argument("--baseline", help="JSON file with the baseline to compare with")
+    parser.add_argument("--save_baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline")
+    parser.add_argument("--output", help="JSON file for the results")
+
+    args = parser.parse_args()
+    _, regressions = main(
+        images=args.images,
+        instances=args.instances,
+        predictions=args.predictions,
+        height=args.height,
+        width=args.width,
+        seed=args.seed,
+        repeat=args.repeat,
+        workers=args.workers,
+        stages=args.stages,
+        baseline=args.baseline,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        output=args.output,
+    )
+    if regressions:
+        raise SystemExit(1)
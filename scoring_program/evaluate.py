@@ -1,92 +1,239 @@
 #!/usr/bin/env python
 from __future__ import print_function, absolute_import, division
 import argparse
+import cProfile
+import json
+import time
+import zipfile
 from pathlib import Path
 import numpy as np
 from collections import namedtuple
-import tempfile
 
 import evaluation.evalInstanceLevelSemanticLabeling as cityscapes_eval
-from preprocess_files import prepare_submitted_files
-
-
-def main(submit_path, labels_path , output_path):
-    with tempfile.TemporaryDirectory() as postprocessed_files:
-        postprocessed_files = Path(postprocessed_files)
-
-        output_path = Path(output_path)
-        submit_path = Path(submit_path)
-        labels_path = Path(labels_path)
-
-        if not submit_path.is_dir:
-            print(f"{submit_path} doesn't exist")
-
-        if submit_path.is_dir() and labels_path.is_dir():
-            if not output_path.exists():
-                output_path.mkdir()
-
-        prepare_submitted_files(
-            submission_path=submit_path, temp_folder=postprocessed_files
+from evaluation.instrumentation import recordStages, stageReport
+
+CsFile = namedtuple("csFile", ["city", "sequenceNb", "frameNb", "type", "type2", "ext"])
+
+
+def get_fs_file_info(parts):
+    parts = parts.name
+    parts = parts.split("_")
+    parts = parts[:-1] + parts[-1].split(".")
+    city, rest = parts[:-5], parts[-5:]
+    city = ["_".join(city)]
+    city.extend(rest)
+    return CsFile(*city)
+
+
+def is_submission_archive(submit_path):
+    # a zip file is read directly, without extracting it
+    submit_path = Path(submit_path)
+    return submit_path.is_file() and zipfile.is_zipfile(submit_path)
+
+
+def evaluation_args(labels_path, workers=1):
+    # the arguments of the cityscapes evaluation API for our benchmark
+    return cityscapes_eval.args._replace(
+        gtInstancesFile=str(Path(labels_path) / "gtinstances.npz"),
+        JSONOutput=False,
+        colorized=False,
+        minRegionSizes=np.array([10, 10, 10]),
+        quiet=True,
+        workers=workers,
+        csFileInfo=get_fs_file_info,
+    )
+
+
+def submission_args(args, submit_path):
+    # the submission is read in place, every predicted mask counts as
+    # label 26 (car), for an easier compute
+    submit_path = Path(submit_path)
+    prediction_path = str(submit_path.resolve().absolute())
+    return args._replace(
+        predictionPath=prediction_path,
+        predictionArchive=(
+            cityscapes_eval.PredictionArchive(prediction_path)
+            if is_submission_archive(submit_path)
+            else None
+        ),
+        anomalyLabelID=26,
+        predictionIndex=None,
+    )
+
+
+def get_datasets(labels_path):
+    # the names of the dataset folders in the labels path, e.g. fishyscapes,
+    # roadanomaly and roadobstacle, or None if the labels path holds the
+    # ground truth of a single dataset
+    labels_path = Path(labels_path)
+    if not labels_path.is_dir() or any(labels_path.glob("*.png")):
+        return None
+    datasets = sorted(
+        path.name
+        for path in labels_path.iterdir()
+        if path.is_dir() and any(path.glob("*.png"))
+    )
+    return datasets or None
+
+
+def dataset_args(args, dataset):
+    # the predictions of a dataset are in the folder of the same name
+    return args._replace(
+        predictionPath=str(Path(args.predictionPath) / dataset),
+        predictionIndex=None,
+    )
+
+
+def get_ground_truth_list(labels_path):
+    groundTruthImgList = sorted(list(Path(labels_path).glob("*.png")))
+    groundTruthImgList = [path.resolve().absolute() for path in groundTruthImgList]
+    if len(groundTruthImgList) == 0:
+        print(
+            f"Cannot find any ground truth images to use for evaluation. Searched for: {cityscapes_eval.args.groundTruthSearch}"
         )
-        output_filename = output_path / "scores.txt"
-
-        CsFile = namedtuple(
-            "csFile", ["city", "sequenceNb", "frameNb", "type", "type2", "ext"]
-        )
-
-        def get_fs_file_info(parts):
-            parts = parts.name
-            parts = parts.split("_")
-            parts = parts[:-1] + parts[-1].split(".")
-            city, rest = parts[:-5], parts[-5:]
-            city = ["_".join(city)]
-            city.extend(rest)
-            return CsFile(*city)
-
-        # set some global states in cityscapes evaluation API, before evaluating
-        cityscapes_eval.args.predictionPath = str(
-            postprocessed_files.resolve().absolute()
-        )
-        cityscapes_eval.args.predictionWalk = None
-        cityscapes_eval.args.gtInstancesFile = str(labels_path / "gtinstances.json")
-        cityscapes_eval.args.JSONOutput = False
-        cityscapes_eval.args.colorized = False
-        cityscapes_eval.args.minRegionSizes = np.array([10, 10, 10])
-        cityscapes_eval.args.quiet = True
-        cityscapes_eval.getCsFileInfo = get_fs_file_info
-
-        groundTruthImgList = sorted(list(labels_path.glob("*.png")))
-        groundTruthImgList = [path.resolve().absolute() for path in groundTruthImgList]
-        if len(groundTruthImgList) == 0:
-            print(
-                f"Cannot find any ground truth images to use for evaluation. Searched for: {cityscapes_eval.args.groundTruthSearch}"
+    return groundTruthImgList
+
+
+def write_scores(results, output_filename, dataset_results=None):
+    # the scores of every dataset follow the unified scores
+    ret = {
+        "AP": results["allAp"] * 100,
+        "AP50": results["allAp50%"] * 100,
+    }
+    for dataset, averages in (dataset_results or {}).items():
+        ret[f"{dataset}_AP"] = averages["allAp"] * 100
+        ret[f"{dataset}_AP50"] = averages["allAp50%"] * 100
+    with open(output_filename, "w") as file:
+        for k, v in ret.items():
+            file.write(f"{k}: {v}\n")
+    return ret
+
+
+def write_report(report_filename, seconds):
+    # where the time went, as recorded by the instrumented stages
+    report = stageReport()
+    report["totalSeconds"] = seconds
+    with open(report_filename, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+# the stages of every evaluation are recorded apart from other evaluations
+# running in the same process
+@recordStages()
+def main(
+    submit_path,
+    labels_path,
+    output_path,
+    workers=1,
+    save_matches=False,
+    mask_store=None,
+    match_cache=None,
+    profile=False,
+):
+    start = time.perf_counter()
+    output_path = Path(output_path)
+    submit_path = Path(submit_path)
+    labels_path = Path(labels_path)
+
+    is_archive = is_submission_archive(submit_path)
+
+    if not (submit_path.is_dir() or is_archive):
+        print(f"{submit_path} doesn't exist")
+
+    if (submit_path.is_dir() or is_archive) and labels_path.is_dir():
+        if not output_path.exists():
+            output_path.mkdir()
+
+    output_filename = output_path / "scores.txt"
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    args = submission_args(evaluation_args(labels_path, workers), submit_path)
+    args = args._replace(
+        matchesFile=str(output_path / "matches.npz") if save_matches else None,
+        matchCacheFile=match_cache,
+    )
+
+    # All datasets are matched together, such that they share the worker
+    # processes, and are scored from their part of the matches
+    datasets = get_datasets(labels_path)
+    groundTruthImgList = []
+    predictionImgList = []
+    dataset_images = {}
+    for dataset in datasets or [None]:
+        if dataset is None:
+            dataset_gt = get_ground_truth_list(labels_path)
+            dataset_predictions = cityscapes_eval.getPredictions(dataset_gt, args)
+        else:
+            dataset_gt = get_ground_truth_list(labels_path / dataset)
+            dataset_predictions = cityscapes_eval.getPredictions(
+                dataset_gt, dataset_args(args, dataset)
             )
-
-        predictionImgList = []
-        for gt in groundTruthImgList:
-            predictionImgList.append(
-                cityscapes_eval.getPrediction(gt, cityscapes_eval.args)
-            )
-        results = cityscapes_eval.evaluateImgLists(
-            predictionImgList, groundTruthImgList, cityscapes_eval.args
-        )["averages"]
-
-        ret = {
-            "AP": results["allAp"] * 100,
-            "AP50": results["allAp50%"] * 100,
-        }
-        with open(output_filename, "w") as file:
-            for k, v in ret.items():
-                file.write(f"{k}: {v}\n")
-        print(ret)
+        start_index = len(groundTruthImgList)
+        groundTruthImgList.extend(dataset_gt)
+        predictionImgList.extend(dataset_predictions)
+        dataset_images[dataset] = range(start_index, len(groundTruthImgList))
+
+    if mask_store is not None and is_archive:
+        print("The mask store is only used for extracted submissions")
+    elif mask_store is not None:
+        # decode the masks once, later runs read them from the store
+        mask_store = str(Path(mask_store).resolve().absolute())
+        store = cityscapes_eval.loadMaskStore(mask_store, args.predictionPath)
+        if store is None:
+            # missing, or left incomplete by an interrupted build
+            cityscapes_eval.createMaskStore(predictionImgList, mask_store, args)
+            store = cityscapes_eval.MaskStore(mask_store, args.predictionPath)
+        args = args._replace(maskStore=store)
+
+    gtInstances = cityscapes_eval.getGtInstances(groundTruthImgList, args)
+    match_table = cityscapes_eval.streamMatches(
+        predictionImgList, groundTruthImgList, gtInstances, args
+    )
+    if args.matchesFile:
+        # keep the matches for re-scoring with other parameters
+        match_table.save(args.matchesFile)
+
+    # the unified scores are computed from the pooled matches of all datasets
+    results = cityscapes_eval.evaluateMatchTable(match_table, args)["averages"]
+    dataset_results = {}
+    if datasets:
+        for dataset in datasets:
+            dataset_results[dataset] = cityscapes_eval.evaluateMatchTable(
+                match_table.selectImages(dataset_images[dataset]), args
+            )["averages"]
+
+    ret = write_scores(results, output_filename, dataset_results)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(str(output_path / "profile.prof"))
+    write_report(output_path / "report.json", time.perf_counter() - start)
+    print(ret)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluation Script based on CityScapesScripts")
 
-    parser.add_argument("submit_path", help="Path to the submission file")
-    parser.add_argument("labels_path", help="Path to the labels file")
+    parser.add_argument("submit_path", help="Path to the submission folder or zip file")
+    parser.add_argument("labels_path", help="Path to the labels file, or to a folder with one labels folder per dataset")
     parser.add_argument("output_path", help="Path to the output file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for matching")
+    parser.add_argument("--save_matches", action="store_true", help="Store the matches in the output path for rescore.py")
+    parser.add_argument("--mask_store", help="File with the decoded prediction masks, created if it does not exist")
+    parser.add_argument("--match_cache", help="File caching the matches per image, only changed images are matched again")
+    parser.add_argument("--profile", action="store_true", help="Store a cProfile dump of the main process as profile.prof in the output path")
 
     args = parser.parse_args()
-    main(args.submit_path, args.labels_path , args.output_path)
+    main(
+        args.submit_path,
+        args.labels_path,
+        args.output_path,
+        workers=args.workers,
+        save_matches=args.save_matches,
+        mask_store=args.mask_store,
+        match_cache=args.match_cache,
+        profile=args.profile,
+    )
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+from __future__ import print_function, absolute_import, division
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import evaluation.evalInstanceLevelSemanticLabeling as cityscapes_eval
+from evaluate import (
+    evaluation_args,
+    submission_args,
+    get_ground_truth_list,
+    write_scores,
+)
+
+# the evaluation arguments and the ground truth instances are sent once to
+# every worker process instead of with every submission
+_worker_state = None
+
+
+def _init_worker(args, gt_instances):
+    global _worker_state
+    _worker_state = (args, gt_instances)
+
+
+def _score_submission(task):
+    submit_path, prediction_list, ground_truth_list, submission, output_filename = task
+    args, gt_instances = _worker_state
+    args = args._replace(**submission)
+
+    # a broken submission must not stop the scoring of all others
+    try:
+        match_table = cityscapes_eval.streamMatches(
+            prediction_list, ground_truth_list, gt_instances, args
+        )
+        results = cityscapes_eval.evaluateMatchTable(match_table, args)["averages"]
+    except SystemExit:
+        # the error is already printed
+        return None
+    except Exception as error:
+        print(f"Failed to score {submit_path}: {error!r}")
+        return None
+    return write_scores(results, output_filename)
+
+
+def main(submit_paths, labels_path, output_path, workers=1):
+    output_path = Path(output_path)
+    labels_path = Path(labels_path)
+    submit_paths = [Path(submit_path) for submit_path in submit_paths]
+
+    # every submission gets a folder named after it
+    names = [submit_path.stem for submit_path in submit_paths]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the submissions are not unique")
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    args = evaluation_args(labels_path, workers)
+    groundTruthImgList = get_ground_truth_list(labels_path)
+
+    # the ground truth is loaded once for all submissions
+    gt_instances = cityscapes_eval.getGtInstances(groundTruthImgList, args)
+
+    tasks = []
+    for name, submit_path in zip(names, submit_paths):
+        try:
+            submission = submission_args(args, submit_path)
+            predictionImgList = cityscapes_eval.getPredictions(
+                groundTruthImgList, submission
+            )
+        except SystemExit:
+            print(f"Skipping {submit_path}")
+            continue
+        except Exception as error:
+            print(f"Skipping {submit_path}: {error!r}")
+            continue
+        # only the differences are sent with every submission
+        submission = {
+            "predictionPath": submission.predictionPath,
+            "predictionArchive": submission.predictionArchive,
+            "anomalyLabelID": submission.anomalyLabelID,
+        }
+        submission_output = output_path / name
+        submission_output.mkdir(exist_ok=True)
+        tasks.append(
+            (
+                name,
+                (
+                    submit_path,
+                    predictionImgList,
+                    groundTruthImgList,
+                    submission,
+                    submission_output / "scores.txt",
+                ),
+            )
+        )
+
+    ret = {}
+    with cityscapes_eval.SharedGtImages(groundTruthImgList, workers) as gt_images:
+        # the submissions are scored in parallel, each one by a single process
+        args = args._replace(gtImages=gt_images, workers=1)
+
+        if workers > 1 and len(tasks) > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(args, gt_instances),
+            )
+            with executor:
+                scores = list(executor.map(_score_submission, [task for _, task in tasks]))
+        else:
+            _init_worker(args, gt_instances)
+            scores = [_score_submission(task) for _, task in tasks]
+
+    for (name, _), score in zip(tasks, scores):
+        if score is not None:
+            ret[name] = score
+            print(name, score)
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score many submissions against the same ground truth"
+    )
+
+    parser.add_argument("labels_path", help="Path to the labels file")
+    parser.add_argument("output_path", help="Path to the output folder, with one folder per submission")
+    parser.add_argument("submit_paths", nargs="+", help="Paths to the submission folders or zip files")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for scoring")
+
+    args = parser.parse_args()
+    main(
+        args.submit_paths,
+        args.labels_path,
+        args.output_path,
+        workers=args.workers,
+    )
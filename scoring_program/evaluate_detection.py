@@ -2,90 +2,256 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import json
-import subprocess
+import math
+import re
 import sys
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 
+from evaluation.boxEvaluation import (
+    BoxDataset,
+    BoxEval,
+    BoxStatistics,
+    greedyMatch,
+    summarizeEval,
+)
 
-def install_package(package_name):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package_name])
+# confidence cut-offs of the published operating points
+SCORE_THRESHOLDS = np.linspace(0, 1, 101)
 
+WHITESPACE = re.compile(r"\s*")
 
-install_package("pycocotools==2.0.7")
+DATASETS = ["fishyscapes", "roadanomaly", "roadobstacle"]
 
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
+METRIC_KEYS = [
+    "ap",
+    "ap50",
+    "ap75",
+    "aps",
+    "apm",
+    "apl",
+    "ar1",
+    "ar10",
+    "ar100",
+    "ars",
+    "arm",
+    "arl",
+]
 
 
-def filter_files(label_path, predictions_path, tmp_predictions_path):
-    with open(predictions_path, "r") as f:
-        predictions = json.load(f)
-    with open(label_path, "r") as f:
-        label = json.load(f)
+def iter_json_array(file, chunk_size=1 << 20):
+    # Yield the elements of a json array one by one, reading the file in
+    # chunks, such that the whole document is never held as one string
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    expected = "["
+    while True:
+        # skip whitespace and the separator before the next element
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == expected):
+            if buffer[pos] == expected:
+                expected = None
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of the json array")
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        if buffer[pos] == "]" and expected != "[":
+            return
+        if expected == "[":
+            raise ValueError("Expected a json array")
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            following = WHITESPACE.match(buffer, end).end()
+            complete = buffer[following : following + 1] in (",", "]")
+        except json.JSONDecodeError:
+            complete = False
+        # an element that is cut by the end of the chunk is read again
+        if not complete:
+            if eof:
+                raise ValueError(
+                    f"Invalid json array element at {buffer[pos:pos + 80]!r}"
+                )
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield element
+        pos = end
+        expected = ","
+        if pos > chunk_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def filter_files(image_ids, predictions_path):
+    # The predictions of the given images, streamed from the prediction file
+    # and kept in memory for BoxDataset.loadRes
+    # All predictions are kept if image_ids is None
+    image_ids = set(image_ids) if image_ids is not None else None
     filtered_predictions = list()
-    label_filenames = [file["id"] for file in label["images"]]
-    print(f"Number of bounding box predictions: {len(predictions)}")
-    for prediction in predictions:
-        if prediction["image_id"] in label_filenames:
-            filtered_predictions.append(prediction)
+    num_predictions = 0
+    with open(predictions_path, "r") as f:
+        for prediction in iter_json_array(f):
+            num_predictions += 1
+            if image_ids is None or prediction["image_id"] in image_ids:
+                filtered_predictions.append(prediction)
+    print(f"Number of bounding box predictions: {num_predictions}")
     print(f"Number of bounding box predictions for the GT: {len(filtered_predictions)}")
-    filtered_predictions_path = Path(tmp_predictions_path) / predictions_path.name
-    with open(filtered_predictions_path, "w") as f:
-        json.dump(filtered_predictions, f)
-    return filtered_predictions_path
+    return filtered_predictions
+
+
+def classification_sweep(cocoEval, iou_thresholds, score_thresholds, cat_id=1):
+    # TP/FP/FN and predictions per frame for every IoU threshold and every
+    # confidence cut-off, from the IoUs already computed by cocoEval.evaluate()
+    # Every ground truth box is matched at most once, greedily in order of the
+    # score. The detections kept by a cut-off are a prefix of that order, so
+    # one matching per IoU threshold serves all cut-offs.
+    iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    score_thresholds = np.asarray(score_thresholds, dtype=np.float64)
+    img_ids = cocoEval.params.imgIds
+    num_gt = 0
+    scores = [np.zeros(0)]
+    matched = [np.zeros((len(iou_thresholds), 0), dtype=bool)]
+    for img_id in img_ids:
+        gts = cocoEval._gts[img_id, cat_id]
+        dts = cocoEval._dts[img_id, cat_id]
+        num_gt += len(gts)
+        if not dts:
+            continue
+        # the rows of the IoUs are the detections in the same order, but at
+        # most maxDets of them, the others stay unmatched
+        dt_scores = np.array([dt["score"] for dt in dts], dtype=np.float64)
+        dt_scores = dt_scores[np.argsort(-dt_scores, kind="mergesort")]
+        ious = cocoEval.ious.get((img_id, cat_id), [])
+        no_ignore = np.zeros((1, len(gts)), dtype=bool)
+        dt_matched, _ = greedyMatch(
+            ious, iou_thresholds, no_ignore, no_ignore[0], len(ious)
+        )
+        dt_matched = np.pad(dt_matched[0], ((0, 0), (0, len(dts) - len(ious))))
+        scores.append(dt_scores)
+        matched.append(dt_matched)
+
+    scores = np.concatenate(scores)
+    matched = np.concatenate(matched, axis=1)
+    order = np.argsort(-scores, kind="mergesort")
+    # number of detections with a score of at least each cut-off
+    kept = np.searchsorted(-scores[order], -score_thresholds, side="right")
+    tp_sum = np.cumsum(matched[:, order], axis=1)
+    tp = np.pad(tp_sum, ((0, 0), (1, 0)))[:, kept]
+    return {
+        "iou_thresholds": iou_thresholds,
+        "score_thresholds": score_thresholds,
+        "tp": tp,
+        "fp": kept[None, :] - tp,
+        "fn": num_gt - tp,
+        "ppf": kept / max(len(img_ids), 1),
+        "images": len(img_ids),
+    }
+
+
+def merge_sweeps(sweeps, weights):
+    # The sweep of the pooled datasets, from the sweeps of every dataset at the
+    # same thresholds, where the counts of every dataset are scaled by its weight
+    images = sum(weight * sweep["images"] for sweep, weight in zip(sweeps, weights))
+    merged = {
+        "iou_thresholds": sweeps[0]["iou_thresholds"],
+        "score_thresholds": sweeps[0]["score_thresholds"],
+    }
+    for key in ["tp", "fp", "fn"]:
+        merged[key] = sum(weight * sweep[key] for sweep, weight in zip(sweeps, weights))
+    detections = sum(
+        weight * sweep["ppf"] * sweep["images"]
+        for sweep, weight in zip(sweeps, weights)
+    )
+    merged["ppf"] = detections / images if images else detections
+    merged["images"] = images
+    return merged
+
+
+def sweep_metrics(sweep):
+    # TP/FP/FN and predictions per frame at the first threshold and cut-off
+    return (
+        sweep["tp"][0, 0].item(),
+        sweep["fp"][0, 0].item(),
+        sweep["fn"][0, 0].item(),
+        sweep["ppf"][0].item(),
+    )
 
 
 def compute_classification_metrics(cocoGt, cocoEval, threshold=0.5):
-    imgids = cocoGt.getImgIds()
-    tp_arr = []
-    fp_arr = []
-    fn_arr = []
-    ffp = 0
-    for i in imgids:
-        # get iou score
-        iou = cocoEval.computeIoU(imgId=i, catId=1)
-
-        # get count of gt for a given category
-        gt_len = len(cocoEval._gts[i, 1])
-        # dt len
-        dt_len = len(cocoEval._dts[i, 1])
-        ffp += dt_len
-
-        if len(iou) == 0:
-            fn = gt_len
-            fn_arr.append(fn)
-            tp = 0
-            tp_arr.append(tp)
-            fp = np.maximum(dt_len - tp, 0)
-            fp_arr.append(fp)
-        else:
-            tp = np.sum(iou > threshold)
-            if tp > gt_len:
-                tpp = min(tp, gt_len)
-                tp_arr.append(tpp)
-                fn = np.maximum(gt_len - tpp, 0)
-                fn_arr.append(fn)
-                fp = np.maximum(dt_len - tpp, 0)
-                fp_arr.append(fp)
-            else:
-                tp_arr.append(tp)
-                # FN
-                fn = np.maximum(gt_len - tp, 0)
-                fn_arr.append(fn)
-                # FP
-                fp = np.maximum(dt_len - tp, 0)
-                fp_arr.append(fp)
-    tp = sum(tp_arr)
-    fp = sum(fp_arr)
-    fn = sum(fn_arr)
-    ffp /= len(imgids)
-    return tp, fp, fn, ffp
-
-
-def main(submit_path, labels_path, output_path):
+    # TP/FP/FN of all detections at a single IoU threshold, and the mean
+    # number of predictions per frame
+    return sweep_metrics(classification_sweep(cocoEval, [threshold], [-np.inf]))
+
+
+def score_dataset(task):
+    # The metrics of one dataset together with their sufficient statistics,
+    # from which the metrics of several datasets are merged
+    data, gt_json_path, prediction_json_path = task
+    print(f"Evaluating {data}")
+    cocoGt = BoxDataset.fromFile(gt_json_path)
+    if prediction_json_path.exists():
+        # predictions of images without ground truth are not scored
+        predictions = filter_files(cocoGt.imgs, prediction_json_path)
+    else:
+        print(f"{prediction_json_path} doesn't exist, scoring without predictions")
+        predictions = []
+    cocoDt = cocoGt.loadRes(predictions)
+    # running evaluation
+    cocoEval = BoxEval(cocoGt, cocoDt)
+    cocoEval.evaluate()
+    cocoEval.accumulate()
+    print(f"Results of {data}:")
+    cocoEval.summarize()
+    return {
+        "stats": cocoEval.stats,
+        "statistics": cocoEval.statistics(),
+        "classification": classification_sweep(cocoEval, [0.5], [-np.inf]),
+        "operating_points": classification_sweep(
+            cocoEval, cocoEval.params.iouThrs, SCORE_THRESHOLDS
+        ),
+    }
+
+
+def dataset_results(stats, classification):
+    results = {key: stats[i] for i, key in enumerate(METRIC_KEYS)}
+    (
+        results["tp50"],
+        results["fp50"],
+        results["fn50"],
+        results["ppf"],
+    ) = sweep_metrics(classification)
+    return results
+
+
+def parse_weight(weight):
+    # a "dataset=weight" argument as (dataset, weight)
+    data, _, value = weight.partition("=")
+    try:
+        value = float(value)
+    except ValueError:
+        value = None
+    if not data or value is None:
+        raise argparse.ArgumentTypeError(
+            f"invalid weight {weight!r}, expected DATASET=WEIGHT"
+        )
+    if not math.isfinite(value) or value < 0:
+        raise argparse.ArgumentTypeError(
+            f"invalid weight {weight!r}, the weight must be a finite number >= 0"
+        )
+    return data, value
+
+
+def main(submit_path, labels_path, output_path, workers=1, datasets=None, weights=None):
     output_path = Path(output_path)
     submit_path = Path(submit_path)
     labels_path = Path(labels_path)
@@ -113,63 +279,55 @@ def main(submit_path, labels_path, output_path):
     print(
         "********************************************************************************"
     )
-    metric_keys = [
-        "ap",
-        "ap50",
-        "ap75",
-        "aps",
-        "apm",
-        "apl",
-        "ar1",
-        "ar10",
-        "ar100",
-        "ars",
-        "arm",
-        "arl",
-    ]
 
-    results = dict()
-    with tempfile.TemporaryDirectory() as tmp_predictions_dir:
-        for data in ["fishyscapes"]:
-            print(f"Evaluating {data}")
+    datasets = datasets or DATASETS
+    weights = weights or dict()
+    unknown = sorted(set(weights) - set(datasets))
+    if unknown:
+        raise SystemExit(
+            f"Weights given for {', '.join(unknown)}, which are not among the "
+            f"scored datasets {', '.join(datasets)}"
+        )
+    tasks = []
+    for data in datasets:
+        gt_json_path = labels_path / f"{data}_label.json"
+        if not gt_json_path.exists():
+            print(f"No labels for {data}, skipping it")
+            continue
+        tasks.append((data, gt_json_path, submit_path / f"{data}.json"))
+    if not tasks:
+        raise SystemExit(f"No labels for any of {', '.join(datasets)} in {labels_path}")
 
-            gt_json_path = Path(labels_path) / f"{data}_label.json"
-            prediction_json_path = Path(submit_path) / f"{data}.json"
+    # every dataset is scored by one process
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            scored = list(executor.map(score_dataset, tasks))
+    else:
+        scored = [score_dataset(task) for task in tasks]
 
-            cocoGt = COCO(str(gt_json_path))
-            if data == "fishyscapes":
-                prediction_json_path = filter_files(
-                    gt_json_path, prediction_json_path, tmp_predictions_dir
-                )
-            cocoDt = cocoGt.loadRes(str(prediction_json_path))
-            # running evaluation
-            cocoEval = COCOeval(cocoGt, cocoDt, "bbox")
-            cocoEval.evaluate()
-            cocoEval.accumulate()
-            cocoEval.summarize()
-
-            results[data] = {
-                key: cocoEval.stats[i] for i, key in enumerate(metric_keys)
-            }
-            (
-                results[data]["tp50"],
-                results[data]["fp50"],
-                results[data]["fn50"],
-                results[data]["ppf"],
-            ) = compute_classification_metrics(cocoGt, cocoEval, threshold=0.5)
-
-    metric_keys.extend(
-        [
-            "tp50",
-            "fp50",
-            "fn50",
-            "ppf",
-        ]
+    results = dict()
+    operating_points = dict()
+    for (data, _, _), dataset in zip(tasks, scored):
+        results[data] = dataset_results(dataset["stats"], dataset["classification"])
+        operating_points[data] = dataset["operating_points"]
+
+    # the unified metrics are the ones of all datasets pooled, each weighted
+    dataset_weights = [weights.get(data, 1.0) for data, _, _ in tasks]
+    weight_names = [f"{data}: {w}" for (data, _, _), w in zip(tasks, dataset_weights)]
+    print(f"Results of unified ({', '.join(weight_names)}):")
+    statistics = BoxStatistics.merge(
+        [dataset["statistics"] for dataset in scored], dataset_weights
+    )
+    results["unified"] = dataset_results(
+        summarizeEval(statistics.accumulate()),
+        merge_sweeps(
+            [dataset["classification"] for dataset in scored], dataset_weights
+        ),
     )
-    fslaf_coeff = 1
-    results["unified"] = dict()
-    for key in metric_keys:
-        results["unified"][key] = results["fishyscapes"][key] * fslaf_coeff
+    operating_points["unified"] = merge_sweeps(
+        [dataset["operating_points"] for dataset in scored], dataset_weights
+    )
+
     ret = {
         "AP": results["unified"]["ap"] * 100,
         "AP50": results["unified"]["ap50"] * 100,
@@ -180,6 +338,14 @@ def main(submit_path, labels_path, output_path):
     with open(output_filename, "w") as file:
         for k, v in ret.items():
             file.write(f"{k}: {v}\n")
+    with open(output_path / "operating_points.json", "w") as file:
+        json.dump(
+            {
+                data: {key: np.asarray(value).tolist() for key, value in sweep.items()}
+                for data, sweep in operating_points.items()
+            },
+            file,
+        )
     print(f"Results :{results}")
 
 
@@ -191,6 +357,26 @@ if __name__ == "__main__":
     parser.add_argument("submit_path", help="Path to the submission file")
     parser.add_argument("labels_path", help="Path to the labels file")
     parser.add_argument("output_path", help="Path to the output file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes used for scoring"
+    )
+    parser.add_argument(
+        "--datasets", nargs="+", default=DATASETS, help="Datasets to score"
+    )
+    parser.add_argument(
+        "--weights",
+        nargs="+",
+        type=parse_weight,
+        metavar="DATASET=WEIGHT",
+        help="Weights of the datasets in the unified metrics, 1 by default",
+    )
 
     args = parser.parse_args()
-    main(args.submit_path, args.labels_path, args.output_path)
+    main(
+        args.submit_path,
+        args.labels_path,
+        args.output_path,
+        workers=args.workers,
+        datasets=args.datasets,
+        weights=dict(args.weights or []),
+    )
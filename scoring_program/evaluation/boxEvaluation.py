@@ -0,0 +1,355 @@
+#!/usr/bin/python
+#
+# Evaluation of bounding box detections in the format of the COCO API
+#
+# The metrics are the ones of pycocotools' COCOeval for the "bbox" type, with
+# the same parameters, the same greedy matching and the same accumulation,
+# such that all 12 stats agree. The intersections over union of an image are
+# computed as one matrix, the matching of a detection is done for all IoU
+# thresholds and area ranges at once, and the precision and recall come from
+# cumulative sums over all detections sorted by score.
+#
+
+from __future__ import print_function, absolute_import, division
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+# A dataset of images, categories and box annotations, as in a COCO json
+# The boxes are given as [x, y, width, height]
+class BoxDataset(object):
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.imgs    = dict( (img["id"],img) for img in dataset.get("images", []) )
+        self.cats    = dict( (cat["id"],cat) for cat in dataset.get("categories", []) )
+        self.anns    = dataset.get("annotations", [])
+
+    @classmethod
+    def fromFile(cls, jsonFile):
+        with open(jsonFile, "r") as f:
+            return cls(json.load(f))
+
+    def getImgIds(self):
+        return sorted(self.imgs)
+
+    def getCatIds(self):
+        return sorted(self.cats)
+
+    # Detections of the images of this dataset, given as a list of dicts with
+    # "image_id", "category_id", "bbox" and "score", or as a json file
+    # As with COCO.loadRes, the area of a detection is the area of its box
+    def loadRes(self, predictions):
+        if not isinstance(predictions, list):
+            with open(predictions, "r") as f:
+                predictions = json.load(f)
+        unknownImgIds = set( p["image_id"] for p in predictions ).difference(self.imgs)
+        if unknownImgIds:
+            raise ValueError("Results do not correspond to current coco set, unknown image ids: {}".format(sorted(unknownImgIds)[:10]))
+        anns = []
+        for (num,prediction) in enumerate(predictions):
+            bbox = prediction["bbox"]
+            anns.append( dict(prediction, area=bbox[2] * bbox[3], id=num + 1, iscrowd=0) )
+        return BoxDataset( { "images"      : self.dataset.get("images", []) ,
+                             "categories"  : self.dataset.get("categories", []) ,
+                             "annotations" : anns } )
+
+
+# The parameters of COCOeval for bounding boxes
+class BoxEvalParams(object):
+    def __init__(self):
+        self.imgIds     = []
+        self.catIds     = []
+        self.iouThrs    = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+        self.recThrs    = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+        self.maxDets    = [1, 10, 100]
+        self.areaRng    = [[0 ** 2, 1e5 ** 2], [0 ** 2, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]]
+        self.areaRngLbl = ["all", "small", "medium", "large"]
+
+
+# Boxes, areas and crowd flags of a list of annotations as arrays
+def boxColumns(anns):
+    boxes = np.array( [ ann["bbox"] for ann in anns ] , dtype=np.float64 ).reshape(-1, 4)
+    areas = np.array( [ ann.get("area", ann["bbox"][2] * ann["bbox"][3]) for ann in anns ] , dtype=np.float64 )
+    crowd = np.array( [ bool(ann.get("iscrowd", 0)) for ann in anns ] , dtype=bool )
+    return ( boxes , areas , crowd )
+
+# Intersection over union of all pairs of detection and ground truth boxes,
+# with the box of the detection as union for crowd ground truth
+def boxIou(dtBoxes, gtBoxes, gtCrowd):
+    (dx,dy,dw,dh) = [ c[:,None] for c in dtBoxes.T ]
+    (gx,gy,gw,gh) = [ c[None,:] for c in gtBoxes.T ]
+    w = np.clip( np.minimum(dx + dw, gx + gw) - np.maximum(dx, gx) , 0 , None )
+    h = np.clip( np.minimum(dy + dh, gy + gh) - np.maximum(dy, gy) , 0 , None )
+    intersection = w * h
+    dtArea = dw * dh
+    union  = np.where( gtCrowd[None,:] , dtArea , dtArea + gw * gh - intersection )
+    return np.divide( intersection , union , out=np.zeros_like(intersection) , where=intersection > 0 )
+
+
+# Greedy matching of nbDts detections, sorted by score, with the ground truth
+# of an image, given their IoU matrix, for every row of ignore flags gtIgnore
+# [A,G] and every IoU threshold at once
+# A detection takes the unmatched ground truth with the highest IoU above
+# the threshold, where ignored ground truth is only taken if no other is
+# left. Crowd ground truth can be matched several times.
+# Returns whether every detection is matched, and whether it is matched to
+# ignored ground truth, both of shape [A,T,D]
+def greedyMatch(ious, iouThrs, gtIgnore, gtCrowd, nbDts):
+    (A,T,G) = ( len(gtIgnore) , len(iouThrs) , gtIgnore.shape[1] )
+    gtMatched = np.zeros( (A,T,G)     , dtype=bool )
+    dtMatched = np.zeros( (A,T,nbDts) , dtype=bool )
+    dtIgnore  = np.zeros( (A,T,nbDts) , dtype=bool )
+    if not len(ious):
+        return ( dtMatched , dtIgnore )
+    thrs = np.minimum(iouThrs, 1 - 1e-10)[None,:,None]
+    # detections below the lowest threshold stay unmatched
+    for d in np.flatnonzero( ious.max(axis=1) >= thrs.min() ):
+        iou = ious[d][None,None,:]
+        candidates = ( iou >= thrs ) & ( ~gtMatched | gtCrowd )
+        preferred  = candidates & ~gtIgnore[:,None,:]
+        candidates = np.where( preferred.any(axis=2, keepdims=True) , preferred , candidates )
+        # the last of the ground truth with the highest IoU
+        key = np.where( candidates , iou , -1. )
+        m = G - 1 - np.argmax( key[:,:,::-1] , axis=2 )
+        matched = candidates.any(axis=2)
+        (a,t) = np.nonzero(matched)
+        gtMatched[a,t,m[a,t]] = True
+        dtMatched[:,:,d] = matched
+        dtIgnore [a,t,d] = gtIgnore[a,m[a,t]]
+    return ( dtMatched , dtIgnore )
+
+
+# Drop-in replacement of COCOeval(cocoGt, cocoDt, "bbox")
+class BoxEval(object):
+    def __init__(self, cocoGt, cocoDt):
+        self.cocoGt = cocoGt
+        self.cocoDt = cocoDt
+        self.params = BoxEvalParams()
+        self.params.imgIds = cocoGt.getImgIds()
+        self.params.catIds = cocoGt.getCatIds()
+        self._gts     = defaultdict(list)
+        self._dts     = defaultdict(list)
+        self.ious     = {}
+        self.evalImgs = {}
+        self.eval     = {}
+        self.stats    = []
+
+    def _prepare(self):
+        p = self.params
+        imgIds = set(p.imgIds)
+        catIds = set(p.catIds)
+        self._gts = defaultdict(list)
+        self._dts = defaultdict(list)
+        for ann in self.cocoGt.anns:
+            if ann["image_id"] in imgIds and ann["category_id"] in catIds:
+                self._gts[ann["image_id"],ann["category_id"]].append(ann)
+        for ann in self.cocoDt.anns:
+            if ann["image_id"] in imgIds and ann["category_id"] in catIds:
+                self._dts[ann["image_id"],ann["category_id"]].append(ann)
+
+    # The detections of an image sorted by score, at most maxDets[-1]
+    def _sortedDts(self, imgId, catId):
+        dts = self._dts[imgId,catId]
+        order = np.argsort( [ -dt["score"] for dt in dts ] , kind="mergesort" )
+        return [ dts[i] for i in order[:self.params.maxDets[-1]] ]
+
+    # IoU matrix of the sorted detections and the ground truth of an image,
+    # or an empty list if either is missing
+    def computeIoU(self, imgId, catId):
+        gts = self._gts[imgId,catId]
+        dts = self._sortedDts(imgId, catId)
+        if not gts or not dts:
+            return []
+        (gtBoxes,_,gtCrowd) = boxColumns(gts)
+        (dtBoxes,_,_)       = boxColumns(dts)
+        return boxIou(dtBoxes, gtBoxes, gtCrowd)
+
+    # Match the detections of an image for every area range and IoU threshold
+    def _evaluateImg(self, imgId, catId):
+        p = self.params
+        gts = self._gts[imgId,catId]
+        dts = self._sortedDts(imgId, catId)
+        if not gts and not dts:
+            return None
+        (_,gtAreas,gtCrowd) = boxColumns(gts)
+        (_,dtAreas,_)       = boxColumns(dts)
+        areaRng = np.array(p.areaRng, dtype=np.float64)
+        # [A,G] and [A,D]
+        gtIgnore   = gtCrowd[None,:] | ( gtAreas[None,:] < areaRng[:,:1] ) | ( gtAreas[None,:] > areaRng[:,1:] )
+        dtOutside  =                   ( dtAreas[None,:] < areaRng[:,:1] ) | ( dtAreas[None,:] > areaRng[:,1:] )
+
+        (dtMatched,dtIgnore) = greedyMatch(self.ious.get( (imgId,catId) , [] ), p.iouThrs, gtIgnore, gtCrowd, len(dts))
+        # unmatched detections outside of the area range are ignored
+        dtIgnore |= ~dtMatched & dtOutside[:,None,:]
+
+        return { "dtScores"  : np.array( [ dt["score"] for dt in dts ] , dtype=np.float64 ) ,
+                 "dtMatched" : dtMatched ,
+                 "dtIgnore"  : dtIgnore  ,
+                 "gtIgnore"  : gtIgnore  }
+
+    def evaluate(self):
+        start = time.time()
+        p = self.params
+        self._prepare()
+        self.ious = dict( ( (imgId,catId) , self.computeIoU(imgId, catId) )
+                          for imgId in p.imgIds for catId in p.catIds )
+        self.evalImgs = {}
+        for catId in p.catIds:
+            for imgId in p.imgIds:
+                evalImg = self._evaluateImg(imgId, catId)
+                if evalImg is not None:
+                    self.evalImgs[imgId,catId] = evalImg
+        print("Evaluated {} images in {:0.2f}s.".format(len(p.imgIds), time.time() - start))
+
+    # The sufficient statistics of the precision and recall of this dataset
+    def statistics(self):
+        p = self.params
+        categories = {}
+        for catId in p.catIds:
+            E = [ self.evalImgs[imgId,catId] for imgId in p.imgIds if (imgId,catId) in self.evalImgs ]
+            if not E:
+                continue
+            categories[catId] = {
+                "scores"  : np.concatenate( [ e["dtScores"] for e in E ] ) ,
+                # the rank of every detection by score within its image
+                "ranks"   : np.concatenate( [ np.arange(len(e["dtScores"])) for e in E ] ) ,
+                "matched" : np.concatenate( [ e["dtMatched"] for e in E ] , axis=2 ) ,
+                "ignored" : np.concatenate( [ e["dtIgnore" ] for e in E ] , axis=2 ) ,
+                "weights" : np.ones( sum( len(e["dtScores"]) for e in E ) ) ,
+                "npig"    : np.sum( [ np.count_nonzero(~e["gtIgnore"], axis=1) for e in E ] , axis=0 ).astype(np.float64) ,
+            }
+        return BoxStatistics(p, categories)
+
+    # Precision at every recall threshold and the final recall, for every
+    # IoU threshold, category, area range and number of detections
+    def accumulate(self):
+        self.eval = self.statistics().accumulate()
+
+    # The 12 stats of COCOeval.summarize
+    def summarize(self):
+        if not self.eval:
+            raise Exception("Please run accumulate() first")
+        self.stats = summarizeEval(self.eval)
+
+
+# Everything the precision and recall of a dataset are computed from, for
+# every category: the score, the rank within its image and the matches of all
+# detections, in the order of their images, and the number of ground truth
+# boxes that are not ignored, per area range.
+# The statistics of several datasets merge by concatenation, such that the
+# merged metrics are the ones of the pooled detections and ground truth. Every
+# dataset can be given a weight, which scales its detections and ground truth.
+class BoxStatistics(object):
+    def __init__(self, params, categories=None):
+        self.params     = params
+        self.categories = categories if categories is not None else {}
+
+    @classmethod
+    def merge(cls, statistics, weights=None):
+        statistics = list(statistics)
+        if weights is None:
+            weights = [1.] * len(statistics)
+        params = BoxEvalParams()
+        params.catIds = sorted( set( catId for stats in statistics for catId in stats.categories ) )
+        categories = {}
+        for catId in params.catIds:
+            parts = [ (stats.categories[catId],weight) for (stats,weight) in zip(statistics,weights) if catId in stats.categories ]
+            categories[catId] = {
+                "scores"  : np.concatenate( [ part["scores" ] for (part,_) in parts ] ) ,
+                "ranks"   : np.concatenate( [ part["ranks"  ] for (part,_) in parts ] ) ,
+                "matched" : np.concatenate( [ part["matched"] for (part,_) in parts ] , axis=2 ) ,
+                "ignored" : np.concatenate( [ part["ignored"] for (part,_) in parts ] , axis=2 ) ,
+                "weights" : np.concatenate( [ part["weights"] * weight for (part,weight) in parts ] ) ,
+                "npig"    : np.sum( [ part["npig"] * weight for (part,weight) in parts ] , axis=0 ) ,
+            }
+        return cls(params, categories)
+
+    # The precision and recall in the format of COCOeval.eval
+    def accumulate(self):
+        p = self.params
+        (T,R,K,A,M) = ( len(p.iouThrs) , len(p.recThrs) , len(p.catIds) , len(p.areaRng) , len(p.maxDets) )
+        precision = -np.ones( (T,R,K,A,M) )
+        recall    = -np.ones( (T,K,A,M) )
+        scores    = -np.ones( (T,R,K,A,M) )
+
+        for (k,catId) in enumerate(p.catIds):
+            if not catId in self.categories:
+                continue
+            category = self.categories[catId]
+            for a in range(A):
+                npig = category["npig"][a]
+                if npig == 0:
+                    continue
+                for (m,maxDet) in enumerate(p.maxDets):
+                    kept      = category["ranks"] < maxDet
+                    dtScores  = category["scores"][kept]
+                    order     = np.argsort( -dtScores , kind="mergesort" )
+                    dtScores  = dtScores[order]
+                    weights   = category["weights"][kept][order]
+                    dtMatched = category["matched"][a][:,kept][:,order]
+                    dtIgnore  = category["ignored"][a][:,kept][:,order]
+
+                    tpSum = np.cumsum( np.where(  dtMatched & ~dtIgnore , weights , 0. ) , axis=1 )
+                    fpSum = np.cumsum( np.where( ~dtMatched & ~dtIgnore , weights , 0. ) , axis=1 )
+                    nd = len(dtScores)
+                    if not nd:
+                        recall[:,k,a,m] = 0
+                        precision[:,:,k,a,m] = 0
+                        scores[:,:,k,a,m] = 0
+                        continue
+                    rc = tpSum / npig
+                    pr = tpSum / ( fpSum + tpSum + np.spacing(1) )
+                    # make the precision monotonically decreasing
+                    pr = np.maximum.accumulate( pr[:,::-1] , axis=1 )[:,::-1]
+                    recall[:,k,a,m] = rc[:,-1]
+                    for t in range(T):
+                        inds  = np.searchsorted( rc[t] , p.recThrs , side="left" )
+                        valid = inds < nd
+                        inds  = np.minimum( inds , nd - 1 )
+                        precision[t,:,k,a,m] = np.where( valid , pr[t,inds] , 0 )
+                        scores   [t,:,k,a,m] = np.where( valid , dtScores[inds] , 0 )
+
+        return { "params"    : p ,
+                 "counts"    : [T,R,K,A,M] ,
+                 "precision" : precision ,
+                 "recall"    : recall ,
+                 "scores"    : scores }
+
+
+def _summarize(evalResult, ap=1, iouThr=None, areaRng="all", maxDets=100):
+    p = evalResult["params"]
+    iStr     = " {:<18} {} @[ IoU={:<9} | area={:>6s} | maxDets={:>3d} ] = {:0.3f}"
+    titleStr = "Average Precision" if ap == 1 else "Average Recall"
+    typeStr  = "(AP)" if ap == 1 else "(AR)"
+    iouStr   = "{:0.2f}:{:0.2f}".format(p.iouThrs[0], p.iouThrs[-1]) if iouThr is None else "{:0.2f}".format(iouThr)
+
+    aind = [ i for (i,aRng) in enumerate(p.areaRngLbl) if aRng == areaRng ]
+    mind = [ i for (i,mDet) in enumerate(p.maxDets) if mDet == maxDets ]
+    s = evalResult["precision"] if ap == 1 else evalResult["recall"]
+    if iouThr is not None:
+        s = s[ np.where(iouThr == p.iouThrs)[0] ]
+    s = s[:,:,:,aind,mind] if ap == 1 else s[:,:,aind,mind]
+    meanS = -1 if not np.any(s > -1) else np.mean(s[s > -1])
+    print(iStr.format(titleStr, typeStr, iouStr, areaRng, maxDets, meanS))
+    return meanS
+
+# The 12 stats of COCOeval.summarize, from the result of accumulate
+def summarizeEval(evalResult):
+    maxDets = evalResult["params"].maxDets
+    stats = np.zeros((12,))
+    stats[0]  = _summarize(evalResult, 1)
+    stats[1]  = _summarize(evalResult, 1, iouThr=.5 , maxDets=maxDets[2])
+    stats[2]  = _summarize(evalResult, 1, iouThr=.75, maxDets=maxDets[2])
+    stats[3]  = _summarize(evalResult, 1, areaRng="small" , maxDets=maxDets[2])
+    stats[4]  = _summarize(evalResult, 1, areaRng="medium", maxDets=maxDets[2])
+    stats[5]  = _summarize(evalResult, 1, areaRng="large" , maxDets=maxDets[2])
+    stats[6]  = _summarize(evalResult, 0, maxDets=maxDets[0])
+    stats[7]  = _summarize(evalResult, 0, maxDets=maxDets[1])
+    stats[8]  = _summarize(evalResult, 0, maxDets=maxDets[2])
+    stats[9]  = _summarize(evalResult, 0, areaRng="small" , maxDets=maxDets[2])
+    stats[10] = _summarize(evalResult, 0, areaRng="medium", maxDets=maxDets[2])
+    stats[11] = _summarize(evalResult, 0, areaRng="large" , maxDets=maxDets[2])
+    return stats
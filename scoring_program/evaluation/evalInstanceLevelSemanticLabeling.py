@@ -28,27 +28,57 @@
 # - The field "confidencePrediction" is a float value that assigns a
 # confidence score to the mask.
 #
-# Note that this tool creates a file named "gtInstances.json" during its
-# first run. This file helps to speed up computation and should be deleted
-# whenever anything changes in the ground truth annotations or anything
-# goes wrong.
+# Instead of a text file, the predictions of an image can be given as a
+# json file with run-length encoded masks in the format of COCO results:
+#   [ { "segmentation": { "size": [height,width], "counts": ... },
+#       "category_id": labelIDPrediction, "score": confidencePrediction },
+#     ... ]
+# where "counts" is either the list of run lengths or the compressed string
+# of pycocotools. Such masks are never decoded into full frames.
+#
+# Non-overlapping predictions can also be given as a single 16 bit png per
+# image, where every pixel holds the id of its instance and 0 is none, with
+# a json file naming the png and the instances of interest:
+#   { "instanceMap": relPathInstanceMap,
+#     "instances": [ { "id": instanceID, "category_id": labelIDPrediction,
+#                      "score": confidencePrediction }, ... ] }
+# The path is relative to the json file, as the paths of the text files.
+#
+# Note that this tool creates a file named "gtInstances.npz" during its
+# first run. This file helps to speed up computation. It records a
+# fingerprint of every ground truth image, such that the instances of
+# changed images are recomputed automatically. Delete it if anything goes
+# wrong.
 
 # python imports
 from __future__ import print_function, absolute_import, division
+import io
 import os
 import sys
-import fnmatch
-from copy import deepcopy
+import bisect
 import glob
+import hashlib
 import json
+from collections import namedtuple
+from functools import partial
 
 import numpy as np
 from PIL import Image
 
 # Cityscapes imports
-from .helpers.csHelpers import printError, colors, getColorEntry, getCsFileInfo, ensurePath, writeDict2JSON
+from .helpers.csHelpers import printError, colors, getColorEntry, getCsFileInfo, ensurePath, writeDict2JSON, fileHash
 from .instances2dict import instances2dict
-from .helpers.labels import labels, id2label
+from .intersections import GtIntersectionEngine, boxesOverlap
+from .gtInstancesCache import GtInstancesCache
+from .maskStore import MaskStore, buildMaskStore, loadMaskStore, decodeMask, maskBoundingBox
+from .matchTable import MatchTable, MatchTableBuilder, GT_DTYPE, PRED_DTYPE, PAIR_DTYPE
+from .matchCache import MatchCache, CACHE_VERSION as MATCH_CACHE_VERSION
+from .predictionArchive import PredictionArchive
+from .gtImageStore import SharedGtImages
+from .instrumentation import timed, mergeStages, recordStages
+from .rle import foregroundRuns, runsBoundingBox
+from .helpers.labels import labels, id2label, name2label
+from .helpers.workerPool import mapInWorkers
 
 
 ###################################
@@ -67,47 +97,107 @@ from .helpers.labels import labels, id2label
 #
 # Within the root folder, a matching prediction file is recursively searched.
 # A file matches, if the filename follows the pattern
-# <city>_123456_123456*.txt
+# <city>_123456_123456*.txt (or *.json)
 # for a ground truth filename
 # <city>_123456_123456_gtFine_instanceIds.png
-def getPrediction( groundTruthFile , args ):
-    # determine the prediction path, if the method is first called
-    if not args.predictionPath:
-        rootPath = None
-        if 'CITYSCAPES_RESULTS' in os.environ:
-            rootPath = os.environ['CITYSCAPES_RESULTS']
-        elif 'CITYSCAPES_DATASET' in os.environ:
-            rootPath = os.path.join( os.environ['CITYSCAPES_DATASET'] , "results" )
+# The prediction files are looked up in the given index, which is built once
+# for all ground truth files by walking the prediction path:
+#   predictionIndex = getPredictionIndex(args)
+#   predictionFile  = getPrediction( groundTruthFile , args , predictionIndex )
+def getPrediction( groundTruthFile , args , predictionIndex ):
+    predictionFiles = findPredictions( groundTruthFile , predictionIndex , args.csFileInfo )
+
+    if len(predictionFiles) > 1:
+        printError("Found multiple predictions for ground truth {}".format(groundTruthFile))
+    if not predictionFiles:
+        printError("Found no prediction for ground truth {}".format(groundTruthFile))
+
+    return predictionFiles[0]
+
+# Get the prediction files for a list of ground truth files
+# All missing and ambiguous predictions are reported at once
+def getPredictions( groundTruthList , args ):
+    predictionIndex = getPredictionIndex( args )
+
+    missing   = []
+    ambiguous = []
+    predictionList = []
+    for groundTruthFile in groundTruthList:
+        predictionFiles = findPredictions( groundTruthFile , predictionIndex , args.csFileInfo )
+        if len(predictionFiles) == 1:
+            predictionList.append(predictionFiles[0])
+        elif predictionFiles:
+            ambiguous.append(groundTruthFile)
         else:
-            rootPath = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','..','results')
+            missing.append(groundTruthFile)
+
+    errors = []
+    if missing:
+        errors.append("Found no prediction for {} ground truth file(s):\n  {}".format(len(missing), "\n  ".join(str(gt) for gt in missing)))
+    if ambiguous:
+        errors.append("Found multiple predictions for {} ground truth file(s):\n  {}".format(len(ambiguous), "\n  ".join(str(gt) for gt in ambiguous)))
+    if errors:
+        printError("\n".join(errors))
+
+    return predictionList
+
+# The prediction path of the arguments, or the root folder described above
+def getPredictionPath( args ):
+    if args.predictionPath:
+        return args.predictionPath
+
+    rootPath = None
+    if 'CITYSCAPES_RESULTS' in os.environ:
+        rootPath = os.environ['CITYSCAPES_RESULTS']
+    elif 'CITYSCAPES_DATASET' in os.environ:
+        rootPath = os.path.join( os.environ['CITYSCAPES_DATASET'] , "results" )
+    else:
+        rootPath = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','..','results')
 
-        if not os.path.isdir(rootPath):
-            printError("Could not find a result root folder. Please read the instructions of this method.")
+    if not os.path.isdir(rootPath):
+        printError("Could not find a result root folder. Please read the instructions of this method.")
 
-        args.predictionPath = os.path.abspath(rootPath)
+    return os.path.abspath(rootPath)
 
-    # walk the prediction path, if not happened yet
-    if not args.predictionWalk:
+# Walk the prediction path once and index all prediction files
+# The index of the arguments is used, if they have one
+def getPredictionIndex( args ):
+    if args.predictionIndex is not None:
+        return args.predictionIndex
+
+    predictionPath = getPredictionPath( args )
+    if args.predictionArchive:
+        walk = args.predictionArchive.walk(predictionPath)
+    else:
         walk = []
-        for root, dirnames, filenames in os.walk(args.predictionPath):
+        for root, dirnames, filenames in os.walk(predictionPath):
             walk.append( (root,filenames) )
-        args.predictionWalk = walk
-
-    csFile = getCsFileInfo(groundTruthFile)
-    filePattern = "{}_{}_{}*.txt".format( csFile.city , csFile.sequenceNb , csFile.frameNb )
-
-    predictionFile = None
-    for root, filenames in args.predictionWalk:
-        for filename in fnmatch.filter(filenames, filePattern):
-            if not predictionFile:
-                predictionFile = os.path.join(root, filename)
-            else:
-                printError("Found multiple predictions for ground truth {}".format(groundTruthFile))
-
-    if not predictionFile:
-        printError("Found no prediction for ground truth {}".format(groundTruthFile))
 
-    return predictionFile
+    return buildPredictionIndex(walk)
+
+# Sorted list of all (filename, root) of the prediction text and json files
+def buildPredictionIndex( predictionWalk ):
+    index = []
+    for root, filenames in predictionWalk:
+        for filename in filenames:
+            if filename.endswith(".txt") or filename.endswith(".json"):
+                index.append( (filename,root) )
+    index.sort()
+    return index
+
+# All prediction files matching the pattern <city>_123456_123456*.txt (or *.json)
+# Since the index is sorted, the files sharing this prefix are adjacent
+def findPredictions( groundTruthFile , predictionIndex , csFileInfo=getCsFileInfo ):
+    csFile = csFileInfo(groundTruthFile)
+    prefix = "{}_{}_{}".format( csFile.city , csFile.sequenceNb , csFile.frameNb )
+
+    predictionFiles = []
+    i = bisect.bisect_left( predictionIndex , (prefix,) )
+    while i < len(predictionIndex) and predictionIndex[i][0].startswith(prefix):
+        (filename,root) = predictionIndex[i]
+        predictionFiles.append( os.path.join(root, filename) )
+        i += 1
+    return predictionFiles
 
 
 ######################
@@ -115,62 +205,122 @@ def getPrediction( groundTruthFile , args ):
 ######################
 
 
-# A dummy class to collect all bunch of data
-class CArgs(object):
-    pass
-# And a global object of that class
-args = CArgs()
-
-# Where to look for Cityscapes
-if 'CITYSCAPES_DATASET' in os.environ:
-    args.cityscapesPath = os.environ['CITYSCAPES_DATASET']
-else:
-    args.cityscapesPath = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','..')
-
-# Parameters that should be modified by user
-args.exportFile         = os.path.join( args.cityscapesPath , "evaluationResults" , "resultInstanceLevelSemanticLabeling.json" )
-args.groundTruthSearch  = os.path.join( args.cityscapesPath , "gtFine" , "val" , "*", "*_gtFine_instanceIds.png" )
-
-# overlaps for evaluation
-args.overlaps           = np.arange(0.5,1.,0.05)
-# minimum region size for evaluation [pixels]
-args.minRegionSizes     = np.array( [ 100 , 1000 , 1000 ] )
-# distance thresholds [m]
-args.distanceThs        = np.array( [  float('inf') , 100 , 50 ] )
-# distance confidences
-args.distanceConfs      = np.array( [ -float('inf') , 0.5 , 0.5 ] )
-
-args.gtInstancesFile    = os.path.join(os.path.dirname(os.path.realpath(__file__)),'gtInstances.json')
-args.distanceAvailable  = False
-args.JSONOutput         = True
-args.quiet              = False
-args.csv                = False
-args.colorized          = True
-args.instLabels         = []
-
-# store some parameters for finding predictions in the args variable
-# the values are filled when the method getPrediction is first called
-args.predictionPath = None
-args.predictionWalk = None
-
+# All parameters of an evaluation
+# The arguments are immutable, a changed copy is derived with
+#   args._replace( name=value , ... )
+# Since no function modifies them, evaluations with different arguments can
+# run side by side in one process, e.g. in a thread pool.
+CArgs = namedtuple( "CArgs" , [
+    "cityscapesPath"    , # where to look for Cityscapes
+    "exportFile"        , # the JSON file with the results
+    "groundTruthSearch" , # glob pattern of the ground truth images
+    "overlaps"          , # overlaps for evaluation
+    "minRegionSizes"    , # minimum region size for evaluation [pixels]
+    "distanceThs"       , # distance thresholds [m]
+    "distanceConfs"     , # distance confidences
+    "gtInstancesFile"   , # cache of the ground truth instances
+    "distanceAvailable" ,
+    "JSONOutput"        ,
+    "quiet"             ,
+    "csv"               ,
+    "colorized"         ,
+    "instLabels"        , # the labels that have instances
+    "anomalyLabelID"    , # if set, all predicted masks get this label id, regardless of the label in the prediction files
+    "matchesFile"       , # if set, the matches are stored in this file for later re-scoring
+    "maskStore"         , # if set, a MaskStore with the already decoded prediction masks
+    "matchCacheFile"    , # if set, the matches of every image are cached in this file and only
+                          # images with changed predictions or ground truth are matched again
+    "workers"           , # number of worker processes used to index the ground truth and to match the images
+    "predictionArchive" , # if set, a PredictionArchive and the prediction path points into this zip file
+    "gtImages"          , # if set, a SharedGtImages with the already decoded ground truth images
+    "predictionPath"    , # the root folder of the predictions, see getPredictionPath if not set
+    "predictionIndex"   , # if set, the index of the prediction files created by getPredictionIndex
+    "csFileInfo"        , # function returning the file info of a ground truth image, see getCsFileInfo
+    ] )
 
 # Determine the labels that have instances
-def setInstanceLabels(args):
-    args.instLabels = []
+def getInstanceLabels():
+    instLabels = []
     for label in labels:
         if label.hasInstances and not label.ignoreInEval:
-            args.instLabels.append(label.name)
+            instLabels.append(label.name)
+    return instLabels
+
+# Where to look for Cityscapes
+if 'CITYSCAPES_DATASET' in os.environ:
+    cityscapesPath = os.environ['CITYSCAPES_DATASET']
+else:
+    cityscapesPath = os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','..')
+
+# The default arguments
+# Parameters that should be modified by user are replaced in a copy
+args = CArgs(
+    cityscapesPath     = cityscapesPath,
+    exportFile         = os.path.join( cityscapesPath , "evaluationResults" , "resultInstanceLevelSemanticLabeling.json" ),
+    groundTruthSearch  = os.path.join( cityscapesPath , "gtFine" , "val" , "*", "*_gtFine_instanceIds.png" ),
+    overlaps           = np.arange(0.5,1.,0.05),
+    minRegionSizes     = np.array( [ 100 , 1000 , 1000 ] ),
+    distanceThs        = np.array( [  float('inf') , 100 , 50 ] ),
+    distanceConfs      = np.array( [ -float('inf') , 0.5 , 0.5 ] ),
+    gtInstancesFile    = os.path.join(os.path.dirname(os.path.realpath(__file__)),'gtInstances.npz'),
+    distanceAvailable  = False,
+    JSONOutput         = True,
+    quiet              = False,
+    csv                = False,
+    colorized          = True,
+    instLabels         = getInstanceLabels(),
+    anomalyLabelID     = None,
+    matchesFile        = None,
+    maskStore          = None,
+    matchCacheFile     = None,
+    workers            = 1,
+    predictionArchive  = None,
+    gtImages           = None,
+    predictionPath     = None,
+    predictionIndex    = None,
+    csFileInfo         = getCsFileInfo,
+    )
+
+
+# Check whether a prediction file exists, possibly within the prediction archive
+def isPredictionFile(fileName,args):
+    if args.predictionArchive:
+        return args.predictionArchive.isfile(fileName)
+    return os.path.isfile(fileName)
+
+# Open a prediction file for reading in binary mode, possibly from the prediction archive
+def openPredictionFile(fileName,args):
+    if args.predictionArchive:
+        return args.predictionArchive.open(fileName)
+    return open(fileName, 'rb')
+
+# Hash of the content of a prediction file, possibly within the prediction archive
+def predictionFileHash(fileName,args):
+    if args.predictionArchive:
+        return args.predictionArchive.fileHash(fileName)
+    return fileHash(fileName)
 
 # Read prediction info
 # imgFile, predId, confidence
 def readPredInfo(predInfoFileName,args):
     predInfo = {}
     try:
-        if (not os.path.isfile(predInfoFileName)):
+        if (not isPredictionFile(predInfoFileName,args)):
             printError("Infofile '{}' for the predictions not found.".format(predInfoFileName))
-        with open(predInfoFileName, 'r') as f:
-            for line in f:
+        if predInfoFileName.endswith(".json"):
+            return readJsonPredInfo(predInfoFileName,args)
+        with io.TextIOWrapper(openPredictionFile(predInfoFileName,args)) as f:
+            if args.anomalyLabelID is None:
+                lines = list(f)
+            else:
+                lines = f.read().strip().split("\n")
+                if (len(lines) == 1) and (len(lines[0].split(" ")) == 1):
+                    printError( "No prediction found in {} file. Please provide at least one predicted instance.".format(predInfoFileName) )
+            for line in lines:
                 splittedLine         = line.split(" ")
+                if args.anomalyLabelID is not None:
+                    # every mask is an anomaly, only path and confidence are used
+                    splittedLine     = [ splittedLine[0] , str(args.anomalyLabelID) , splittedLine[-1] ]
                 if len(splittedLine) != 3:
                     printError( "Invalid prediction file. Expected content: relPathPrediction1 labelIDPrediction1 confidencePrediction1" )
                 if os.path.isabs(splittedLine[0]):
@@ -180,7 +330,7 @@ def readPredInfo(predInfoFileName,args):
                 filename             = os.path.abspath( filename )
 
                 # check if that file is actually somewhere within the prediction root
-                if os.path.commonprefix( [filename,args.predictionPath] ) != args.predictionPath:
+                if os.path.commonprefix( [filename,getPredictionPath(args)] ) != getPredictionPath(args):
                     printError( "Predicted mask {} in prediction text file {} points outside of prediction path.".format(filename,predInfoFileName) )
 
                 imageInfo            = {}
@@ -192,25 +342,188 @@ def readPredInfo(predInfoFileName,args):
         return None
     return predInfo
 
-# Routine to read ground truth image
+# Read prediction info of a json file, either a list of run-length encoded
+# masks or the description of an instance map
+def readJsonPredInfo(predInfoFileName,args):
+    with openPredictionFile(predInfoFileName,args) as f:
+        try:
+            content = json.load(f)
+        except ValueError:
+            printError( "Invalid prediction file {}. Could not parse the json content.".format(predInfoFileName) )
+    if isinstance(content, dict):
+        return readInstanceMapPredInfo(predInfoFileName,content,args)
+    if not isinstance(content, list):
+        printError( "Invalid prediction file {}. Expected a list of predictions or an instance map.".format(predInfoFileName) )
+    return readRlePredInfo(predInfoFileName,content,args)
+
+# Read prediction info of run-length encoded masks
+# The masks are named <predInfoFileName>#<index> and keep their encoding
+# in the additional entry "rle"
+def readRlePredInfo(predInfoFileName,entries,args):
+    if not entries and args.anomalyLabelID is not None:
+        printError( "No prediction found in {} file. Please provide at least one predicted instance.".format(predInfoFileName) )
+
+    predInfo = {}
+    for (num,entry) in enumerate(entries):
+        try:
+            rle = entry["segmentation"]
+            if not isinstance(rle["counts"], (str,list)) or len(rle["size"]) != 2:
+                raise ValueError
+            imageInfo            = {}
+            if args.anomalyLabelID is not None:
+                # every mask is an anomaly, only mask and confidence are used
+                imageInfo["labelID"] = int(args.anomalyLabelID)
+            else:
+                imageInfo["labelID"] = int(float(entry["category_id"]))
+            imageInfo["conf"]    = float(entry["score"])
+            imageInfo["rle"]     = rle
+        except (KeyError, TypeError, ValueError):
+            printError( "Invalid prediction file {}. Expected content: [ { \"segmentation\": { \"size\": [h,w], \"counts\": ... }, \"category_id\": labelID, \"score\": confidence }, ... ]".format(predInfoFileName) )
+        predInfo["{}#{}".format(os.path.abspath(predInfoFileName),num)] = imageInfo
+    return predInfo
+
+# Read prediction info of an instance map
+# The instances are named <instanceMapFileName>#<id> and keep the map and
+# their id in the additional entries "instanceMap" and "instanceID"
+def readInstanceMapPredInfo(predInfoFileName,content,args):
+    try:
+        relPath   = content["instanceMap"]
+        instances = content["instances"]
+        if not isinstance(relPath, str) or not isinstance(instances, list):
+            raise ValueError
+    except (KeyError, ValueError):
+        printError( "Invalid prediction file {}. Expected content: { \"instanceMap\": relPath, \"instances\": [ { \"id\": instanceID, \"category_id\": labelID, \"score\": confidence }, ... ] }".format(predInfoFileName) )
+    if not instances and args.anomalyLabelID is not None:
+        printError( "No prediction found in {} file. Please provide at least one predicted instance.".format(predInfoFileName) )
+    if os.path.isabs(relPath):
+        printError( "Invalid prediction file {}. The instance map must be a relative path.".format(predInfoFileName) )
+
+    filename = os.path.abspath( os.path.join( os.path.dirname(predInfoFileName) , relPath ) )
+    # check if that file is actually somewhere within the prediction root
+    if os.path.commonprefix( [filename,getPredictionPath(args)] ) != getPredictionPath(args):
+        printError( "Instance map {} in prediction file {} points outside of prediction path.".format(filename,predInfoFileName) )
+
+    predInfo = {}
+    for entry in instances:
+        try:
+            instanceID = int(entry["id"])
+            if instanceID <= 0 or instanceID > np.iinfo(np.uint16).max:
+                raise ValueError
+            imageInfo               = {}
+            if args.anomalyLabelID is not None:
+                # every instance is an anomaly, only id and confidence are used
+                imageInfo["labelID"] = int(args.anomalyLabelID)
+            else:
+                imageInfo["labelID"] = int(float(entry["category_id"]))
+            imageInfo["conf"]        = float(entry["score"])
+            imageInfo["instanceMap"] = filename
+            imageInfo["instanceID"]  = instanceID
+        except (KeyError, TypeError, ValueError):
+            printError( "Invalid instance in prediction file {}. Expected { \"id\": instanceID > 0, \"category_id\": labelID, \"score\": confidence }.".format(predInfoFileName) )
+        name = "{}#{}".format(filename,instanceID)
+        if name in predInfo:
+            printError( "Instance {} is listed twice in prediction file {}.".format(instanceID,predInfoFileName) )
+        predInfo[name] = imageInfo
+    return predInfo
+
+# Routine to read and decode ground truth image
+# Images are taken from the shared ground truth images if given
+@timed("readGTImage", images=1)
 def readGTImage(gtImageFileName,args):
-    return Image.open(gtImageFileName)
+    if args.gtImages:
+        gtImage = args.gtImages.getImage(gtImageFileName)
+        if gtImage is not None:
+            return gtImage
+    with Image.open(gtImageFileName) as gtImage:
+        return np.array(gtImage)
+
+# Routine to read a prediction mask
+# Returns the binary mask, the bounding box (y0,x0,y1,x1) it covers and the
+# shape of the frame. Masks are taken from the mask store if one is given.
+@timed("readPredMask")
+def readPredMask(predImageFile,args):
+    if args.maskStore:
+        storedMask = args.maskStore.getMask(predImageFile)
+        if storedMask is not None:
+            return storedMask
+    with openPredictionFile(predImageFile,args) as f:
+        boolPredInst = decodeMask(f)
+    # only the bounding box of the mask is intersected with the ground truth
+    (y0,x0,y1,x1) = maskBoundingBox(boolPredInst)
+    return ( boolPredInst[y0:y1,x0:x1] , (y0,x0,y1,x1) , boolPredInst.shape )
+
+# Whether a prediction is given as a png of its own
+def hasMaskFile(imageInfo):
+    return not ( "rle" in imageInfo or "instanceMap" in imageInfo )
+
+# Routine to read the runs of a run-length encoded prediction mask
+# Returns the start indices and the lengths of all runs of ones
+@timed("readPredRuns")
+def readPredRuns(predImageFile,rle,args):
+    try:
+        return foregroundRuns(rle)
+    except ValueError as e:
+        printError("Invalid run-length encoding of {}: {}".format(predImageFile,e))
+
+# Routine to read an instance map and to intersect all its instances at once
+# Returns a matrix with the bin counts of every listed instance and the row
+# of every instance id within it
+@timed("readPredInstanceMap")
+def readPredInstanceMap(instanceMapFile,instanceIDs,engine,args):
+    with openPredictionFile(instanceMapFile,args) as f:
+        instanceMapNp = np.array(Image.open(f))
+    if instanceMapNp.shape != engine.binNp.shape:
+        printError("Instance map {} has size {}, expected {}.".format(instanceMapFile,instanceMapNp.shape,engine.binNp.shape))
+    # the ids index the lookup below, negative ids would silently wrap around
+    if instanceMapNp.dtype.kind not in "ui":
+        printError("Instance map {} has pixels of type {}, expected integer instance ids.".format(instanceMapFile,instanceMapNp.dtype))
+    if instanceMapNp.min() < 0:
+        printError("Instance map {} has negative instance ids, expected ids >= 0.".format(instanceMapFile))
+
+    # row 0 collects all pixels of unlisted ids
+    maxID  = max( int(instanceMapNp.max()) , max(instanceIDs) )
+    lookup = np.zeros( maxID + 1 , dtype=np.int32 )
+    rows   = {}
+    for (num,instanceID) in enumerate(instanceIDs):
+        rows[instanceID]   = num + 1
+        lookup[instanceID] = num + 1
+    return ( engine.intersectRows( lookup[instanceMapNp] , len(instanceIDs) + 1 ) , rows )
+
+# Decode all masks referenced by the prediction files into a mask store
+# Run-length encoded masks and instance maps are not stored, they are
+# cheap to read anyway
+def createMaskStore(predictionList,storeFile,args):
+    maskFileList = []
+    for pred in predictionList:
+        predInfo = readPredInfo(pred,args)
+        maskFileList.extend( predImageFile for predImageFile in predInfo if hasMaskFile(predInfo[predImageFile]) )
+    buildMaskStore(maskFileList, storeFile, getPredictionPath(args), args.workers, not args.quiet)
 
 # either read or compute a dictionary of all ground truth instances
+# The instances are cached in a binary file, only images that are missing
+# in the cache or changed since are recomputed
+@timed("getGtInstances", images=lambda groundTruthList, args: len(groundTruthList))
 def getGtInstances(groundTruthList,args):
-    gtInstances = {}
-    # if there is a global statistics json, then load it
-    if (os.path.isfile(args.gtInstancesFile)):
-        if not args.quiet:
-            print("Loading ground truth instances from JSON.")
-        with open(args.gtInstancesFile) as json_file:
-            gtInstances = json.load(json_file)
-    # otherwise create it
-    else:
+    cache = GtInstancesCache(args.gtInstancesFile)
+    if cache.load() and not args.quiet:
+        print("Loading ground truth instances from cache.")
+
+    outdated = [ gt for gt in groundTruthList if not cache.isValid(gt) ]
+    if outdated:
         if (not args.quiet):
-            print("Creating ground truth instances from png files.")
-        gtInstances = instances2dict(groundTruthList,not args.quiet)
-        writeDict2JSON(gtInstances, args.gtInstancesFile)
+            print("Creating ground truth instances from {} png files.".format(len(outdated)))
+        cache.update( instances2dict(outdated,not args.quiet,args.workers) )
+
+    if cache.modified:
+        try:
+            cache.save()
+        except OSError as e:
+            if not args.quiet:
+                print("Could not write ground truth cache {}: {}".format(args.gtInstancesFile, e))
+
+    gtInstances = {}
+    for gt in groundTruthList:
+        gtInstances[os.path.abspath(gt)] = cache.getInstances(gt)
 
     return gtInstances
 
@@ -224,70 +537,173 @@ def filterGtInstances(singleImageInstances,args):
     return instanceDict
 
 # match ground truth instances with predicted instances
+@timed("matchGtWithPreds", images=lambda predictionList, *rest, **kwargs: len(predictionList))
 def matchGtWithPreds(predictionList,groundTruthList,gtInstances,args):
     matches = {}
     if not args.quiet:
         print("Matching {} pairs of images...".format(len(predictionList)))
 
-    count = 0
-    for (pred,gt) in zip(predictionList,groundTruthList):
-        # key for dicts
-        dictKey = os.path.abspath(gt)
-
-        # Read input files
-        gtImage  = readGTImage(gt,args)
-        predInfo = readPredInfo(pred,args)
+    dictKeys = [ os.path.abspath(gt) for gt in groundTruthList ]
+    results  = list( _mapImagePairs( matchImagePair , predictionList , groundTruthList , gtInstances , args ) )
 
-        # Get and filter ground truth instances
-        unfilteredInstances = gtInstances[ dictKey ]
-        curGtInstancesOrig  = filterGtInstances(unfilteredInstances,args)
-
-        # Try to assign all predictions
-        (curGtInstances,curPredInstances) = assignGt2Preds(curGtInstancesOrig, gtImage, predInfo, args)
+    if not args.quiet:
+        print("")
 
+    for (dictKey,(curGtInstances,curPredInstances)) in zip(dictKeys,results):
         # append to global dict
         matches[ dictKey ] = {}
         matches[ dictKey ]["groundTruth"] = curGtInstances
         matches[ dictKey ]["prediction"]  = curPredInstances
 
-        count += 1
-        if not args.quiet:
-            print("\rImages Processed: {}".format(count), end=' ')
-            sys.stdout.flush()
+    return matches
+
+# match ground truth instances with predicted instances, directly into a MatchTable
+# Every image is reduced to a few numeric rows as soon as it is matched,
+# such that the memory does not depend on the size of the predictions.
+@timed("streamMatches", images=lambda predictionList, *rest, **kwargs: len(predictionList))
+def streamMatches(predictionList,groundTruthList,gtInstances,args):
+    if not args.quiet:
+        print("Matching {} pairs of images...".format(len(predictionList)))
+
+    builder = MatchTableBuilder(len(groundTruthList))
+    if args.matchCacheFile:
+        records = _cachedImagePairRecords(predictionList,groundTruthList,gtInstances,args)
+    else:
+        records = _mapImagePairs( matchImagePairRecords , predictionList , groundTruthList , gtInstances , args )
+    for (gt,(gtRows,predRows,pairRows)) in zip(groundTruthList,records):
+        builder.append(os.path.abspath(gt), gtRows, predRows, pairRows)
 
     if not args.quiet:
         print("")
 
-    return matches
+    return builder.build()
 
-# For a given frame, assign all predicted instances to ground truth instances
-def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
-    # In this method, we create two lists
-    #  - predInstances: contains all predictions and their associated gt
-    #  - gtInstances:   contains all gt instances and their associated predictions
-    predInstances    = {}
-    predInstCount    = 0
+# The records of all pairs of images, where only pairs with changed inputs
+# are matched again, all others are taken from the match cache
+def _cachedImagePairRecords(predictionList,groundTruthList,gtInstances,args):
+    cache = MatchCache(args.matchCacheFile)
+    cache.load()
 
-    # Create a prediction array for each class
-    for label in args.instLabels:
-        predInstances[label] = []
+    keys    = list( _mapImagePairs( imagePairKey , predictionList , groundTruthList , gtInstances , args ) )
+    changed = [ i for (i,key) in enumerate(keys) if cache.get(key) is None ]
+    if not args.quiet:
+        print("")
+        print("Matching {} changed pairs of images...".format(len(changed)))
 
-    # We already know about the gt instances
-    # Add the matching information array
-    gtInstances = deepcopy(gtInstancesOrig)
-    for label in gtInstances:
-        for gt in gtInstances[label]:
-            gt["matchedPred"] = []
+    freshRecords = _mapImagePairs( matchImagePairRecords ,
+                                   [ predictionList [i] for i in changed ] ,
+                                   [ groundTruthList[i] for i in changed ] ,
+                                   gtInstances , args )
+    for (i,records) in zip(changed,freshRecords):
+        cache.put(keys[i], records)
 
-    # Make the gt a numpy array
-    gtNp = np.array(gtImage)
+    try:
+        cache.save(keys)
+    except OSError as e:
+        if not args.quiet:
+            print("Could not write match cache {}: {}".format(args.matchCacheFile, e))
+
+    return [ cache.get(key) for key in keys ]
+
+# A hash of everything the matching of a pair of images depends on:
+# the prediction file, all masks it references, the ground truth image
+# and the labels of interest
+# Run-length encoded masks are part of the prediction file itself, instance
+# maps are hashed once
+def imagePairKey(pred,gt,unfilteredInstances,args):
+    h = hashlib.blake2b(digest_size=16)
+    h.update( repr( ( MATCH_CACHE_VERSION , args.instLabels , args.anomalyLabelID ) ).encode("utf-8") )
+    h.update( fileHash(gt) )
+    with openPredictionFile(pred,args) as f:
+        h.update( f.read() )
+    predInfo = readPredInfo(pred,args)
+    instanceMaps = set()
+    for predImageFile in predInfo:
+        if hasMaskFile(predInfo[predImageFile]):
+            h.update( predictionFileHash(predImageFile,args) )
+        elif "instanceMap" in predInfo[predImageFile]:
+            instanceMap = predInfo[predImageFile]["instanceMap"]
+            if not instanceMap in instanceMaps:
+                instanceMaps.add(instanceMap)
+                h.update( predictionFileHash(instanceMap,args) )
+    return h.hexdigest().encode("ascii")
+
+# Apply pairFunction(pred,gt,unfilteredInstances,args) to all pairs of images,
+# possibly in worker processes
+# The results are returned lazily and in the order of the pairs
+def _mapImagePairs(pairFunction,predictionList,groundTruthList,gtInstances,args):
+    # each pair only needs the ground truth instances of its own image
+    tasks = [ (pred,gt,gtInstances[os.path.abspath(gt)]) for (pred,gt) in zip(predictionList,groundTruthList) ]
+
+    if args.workers > 1 and len(tasks) > 1:
+        # the results are returned in the order of the tasks
+        workerFunction = partial( _runPairInWorker , pairFunction )
+        results = mapInWorkers( workerFunction , tasks , args.workers , initializer=_initMatchWorker , initargs=(args,) )
+        for (result,stages) in _iterProgress( results , args ):
+            # account the time spent in the worker
+            mergeStages(stages)
+            yield result
+    else:
+        for result in _iterProgress( ( pairFunction(*task, args=args) for task in tasks ) , args ):
+            yield result
 
-    # Get a mask of void labels in the groundtruth
-    voidLabelIDList = []
-    for label in labels:
-        if label.ignoreInEval:
-            voidLabelIDList.append(label.id)
-    boolVoid = np.in1d(gtNp, voidLabelIDList).reshape(gtNp.shape)
+# Read a single pair of prediction and ground truth image
+def readImagePair(pred,gt,unfilteredInstances,args):
+    # Read input files
+    gtImage  = readGTImage(gt,args)
+    predInfo = readPredInfo(pred,args)
+
+    # Filter ground truth instances
+    curGtInstancesOrig = filterGtInstances(unfilteredInstances,args)
+
+    return (curGtInstancesOrig, gtImage, predInfo)
+
+# Match a single pair of prediction and ground truth image
+def matchImagePair(pred,gt,unfilteredInstances,args):
+    # Try to assign all predictions
+    return assignGt2Preds( *readImagePair(pred,gt,unfilteredInstances,args) , args=args )
+
+# Match a single pair of prediction and ground truth image into MatchTable rows
+def matchImagePairRecords(pred,gt,unfilteredInstances,args):
+    return assignGt2PredRecords( *readImagePair(pred,gt,unfilteredInstances,args) , args=args )
+
+# The arguments are sent once to every worker process instead of with every task
+_workerArgs = None
+
+def _initMatchWorker(args):
+    global _workerArgs
+    _workerArgs = args
+
+# The stages of every task are sent back with its result
+def _runPairInWorker(pairFunction, task):
+    with recordStages() as recorder:
+        result = pairFunction(*task, args=_workerArgs)
+    return (result, recorder.stages)
+
+# Print the number of processed images while passing the results through
+def _iterProgress(results, args):
+    for (count,result) in enumerate(results):
+        if not args.quiet:
+            print("\rImages Processed: {}".format(count+1), end=' ')
+            sys.stdout.flush()
+        yield result
+
+# For a given frame, intersect all predicted instances with the ground truth
+# Yields for every non-empty prediction of interest a tuple
+#   (predImageFile, labelID, confidence, pixelCount, voidIntersection, intersections)
+# where intersections lists (gtNum, intersection) for all ground truth instances
+# of the same label, that overlap with the prediction.
+def intersectGtWithPreds(gtInstancesOrig, gtImage, predInfo, args):
+    # Make the gt a numpy array, decoded images are used as they are
+    gtNp = np.asarray(gtImage)
+
+    # Assign every gt pixel to void or to one of the gt instances, such that
+    # all intersections of a prediction are counted in a single pass
+    engine = GtIntersectionEngine(gtNp, gtInstancesOrig)
+
+    # All instances of an instance map are intersected at once, when the map
+    # is first needed
+    instanceMapCounts = {}
 
     # Loop through all prediction masks
     for predImageFile in predInfo:
@@ -302,54 +718,105 @@ def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
         if not labelName in args.instLabels:
             continue
 
-        # Read the mask
-        predImage = Image.open(predImageFile)
-        predImage = predImage.convert("L")
-        predNp    = np.array(predImage)
-
-        # make the image really binary, i.e. everything non-zero is part of the prediction
-        boolPredInst   = predNp != 0
-        predPixelCount = np.count_nonzero( boolPredInst )
+        # Read the mask, possibly cropped to its bounding box, as runs or
+        # from the counts of its instance map
+        rle         = predInfo[predImageFile].get("rle")
+        instanceMap = predInfo[predImageFile].get("instanceMap")
+        if instanceMap is not None:
+            if not instanceMap in instanceMapCounts:
+                instanceIDs = [ info["instanceID"] for info in predInfo.values() if info.get("instanceMap") == instanceMap ]
+                instanceMapCounts[instanceMap] = readPredInstanceMap(instanceMap,instanceIDs,engine,args)
+            (counts,rows)  = instanceMapCounts[instanceMap]
+            binCounts      = counts[ rows[predInfo[predImageFile]["instanceID"]] ]
+            predBox        = None
+            predShape      = gtNp.shape
+            predPixelCount = int( binCounts.sum() )
+        elif rle is not None:
+            (runStarts,runLengths) = readPredRuns(predImageFile,rle,args)
+            predShape      = tuple( int(n) for n in rle["size"] )
+            predBox        = runsBoundingBox(runStarts, runLengths, predShape[0])
+            predPixelCount = int( runLengths.sum() )
+        else:
+            (boolPredInst,predBox,predShape) = readPredMask(predImageFile,args)
+            predPixelCount = np.count_nonzero( boolPredInst )
+        if predShape != gtNp.shape:
+            printError("Predicted mask {} has size {}, expected {}.".format(predImageFile,predShape,gtNp.shape))
 
         # skip if actually empty
         if not predPixelCount:
             continue
 
+        # Count the overlap with void and with every gt instance at once,
+        # the counts of an instance map are already known
+        if rle is not None:
+            binCounts = engine.intersectRuns(runStarts, runLengths)
+        elif instanceMap is None:
+            binCounts = engine.intersect(boolPredInst, predBox)
+
+        # Loop through all ground truth instances with matching label
+        # This list contains all ground truth instances that distinguish groups
+        # We do not know, if a certain instance is actually a single object or a group
+        # e.g. car or cargroup
+        # However, for now we treat both the same and do the rest later
+        # Instances outside of the bounding box of the prediction are skipped
+        intersections = []
+        for (gtNum,gtInstance) in enumerate(gtInstancesOrig[labelName]):
+            if not boxesOverlap(gtInstance.get("bbox"), predBox):
+                continue
+            intersection = engine.instanceIntersection(binCounts, gtInstance["instID"])
+            if (intersection > 0):
+                intersections.append( (gtNum,intersection) )
+
+        yield ( predImageFile , int(labelID) , predConf , predPixelCount ,
+                engine.voidIntersection(binCounts) , intersections )
+
+# For a given frame, assign all predicted instances to ground truth instances
+def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
+    # In this method, we create two lists
+    #  - predInstances: contains all predictions and their associated gt
+    #  - gtInstances:   contains all gt instances and their associated predictions
+    predInstances    = {}
+    predInstCount    = 0
+
+    # Create a prediction array for each class
+    for label in args.instLabels:
+        predInstances[label] = []
+
+    # We already know about the gt instances
+    # Add the matching information array
+    gtInstances = {}
+    for label in gtInstancesOrig:
+        gtInstances[label] = [ dict(gt, matchedPred=[]) for gt in gtInstancesOrig[label] ]
+
+    for (predImageFile,labelID,predConf,predPixelCount,voidIntersection,intersections) in intersectGtWithPreds(gtInstancesOrig, gtImage, predInfo, args):
+        labelName = id2label[labelID].name
+
         # The information we want to collect for this instance
         predInstance = {}
         predInstance["imgName"]          = predImageFile
         predInstance["predID"]           = predInstCount
-        predInstance["labelID"]          = int(labelID)
+        predInstance["labelID"]          = labelID
         predInstance["pixelCount"]       = predPixelCount
         predInstance["confidence"]       = predConf
         # Determine the number of pixels overlapping void
-        predInstance["voidIntersection"] = np.count_nonzero( np.logical_and(boolVoid, boolPredInst) )
+        predInstance["voidIntersection"] = voidIntersection
 
         # A list of all overlapping ground truth instances
         matchedGt = []
 
-        # Loop through all ground truth instances with matching label
-        # This list contains all ground truth instances that distinguish groups
-        # We do not know, if a certain instance is actually a single object or a group
-        # e.g. car or cargroup
-        # However, for now we treat both the same and do the rest later
-        for (gtNum,gtInstance) in enumerate(gtInstancesOrig[labelName]):
-
-            intersection = np.count_nonzero( np.logical_and( gtNp == gtInstance["instID"] , boolPredInst) )
-
-            # If they intersect add them as matches to both dicts
-            if (intersection > 0):
-                gtCopy   = gtInstance.copy()
-                predCopy = predInstance.copy()
+        # Add the intersecting instances as matches to both dicts
+        for (gtNum,intersection) in intersections:
+            gtCopy   = gtInstancesOrig[labelName][gtNum].copy()
+            predCopy = predInstance.copy()
 
-                # let the two know their intersection
-                gtCopy["intersection"]   = intersection
-                predCopy["intersection"] = intersection
+            # let the two know their intersection
+            gtCopy["intersection"]   = intersection
+            predCopy["intersection"] = intersection
 
-                # append ground truth to matches
-                matchedGt.append(gtCopy)
-                # append prediction to ground truth instance
-                gtInstances[labelName][gtNum]["matchedPred"].append(predCopy)
+            # append ground truth to matches
+            matchedGt.append(gtCopy)
+            # append prediction to ground truth instance
+            gtInstances[labelName][gtNum]["matchedPred"].append(predCopy)
 
         predInstance["matchedGt"] = matchedGt
         predInstCount += 1
@@ -357,7 +824,32 @@ def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
 
     return (gtInstances,predInstances)
 
-
+# For a given frame, reduce all predicted and ground truth instances to the
+# rows of a MatchTable, without building any dictionaries
+def assignGt2PredRecords(gtInstancesOrig, gtImage, predInfo, args):
+    # remember the row of the first gt instance of each label
+    gtRows     = []
+    firstGtRow = {}
+    for labelName in gtInstancesOrig:
+        firstGtRow[labelName] = len(gtRows)
+        for gt in gtInstancesOrig[labelName]:
+            gtRows.append( ( 0 , gt["labelID"] , gt["instID"] , gt["pixelCount"] , gt["medDist"] , gt["distConf"] ) )
+
+    predRows = []
+    pairRows = []
+    for (predImageFile,labelID,predConf,predPixelCount,voidIntersection,intersections) in intersectGtWithPreds(gtInstancesOrig, gtImage, predInfo, args):
+        labelName = id2label[labelID].name
+        predRow   = len(predRows)
+        predRows.append( ( 0 , predRow , labelID , predPixelCount , predConf , voidIntersection ) )
+        for (gtNum,intersection) in intersections:
+            pairRows.append( ( firstGtRow[labelName] + gtNum , predRow , intersection ) )
+
+    return ( np.array(gtRows  , dtype=GT_DTYPE  ) ,
+             np.array(predRows, dtype=PRED_DTYPE) ,
+             np.array(pairRows, dtype=PAIR_DTYPE) )
+
+
+@timed("evaluateMatches", images=lambda matches, args: len(matches.imgNames) if isinstance(matches, MatchTable) else len(matches))
 def evaluateMatches(matches, args):
     # In the end, we need two vectors for each class and for each overlap
     # The first vector (y_true) is binary and is 1, where the ground truth says true,
@@ -378,9 +870,17 @@ def evaluateMatches(matches, args):
     #   1.) remove all predictions that satisfy the overlap criterion with an ignore region (either void or *group)
     #   2.) remove matches that do not satisfy the overlap
     #   3.) mark non-matched predictions as false positive
+    #
+    # The matches are flattened into a MatchTable once, all overlap thresholds
+    # are then handled at the same time on its columns.
+
+    if isinstance(matches, MatchTable):
+        matchTable = matches
+    else:
+        matchTable = MatchTable.fromMatches(matches)
 
     # AP
-    overlaps  = args.overlaps
+    overlaps  = np.asarray(args.overlaps, dtype=float)
     # region size
     minRegionSizes = args.minRegionSizes
     # distance thresholds
@@ -403,150 +903,85 @@ def evaluateMatches(matches, args):
     # First dimension is class, second overlap
     ap = np.zeros( (len(distThs) , len(args.instLabels) , len(overlaps)) , float )
 
-    for dI,(minRegionSize,distanceTh,distanceConf) in enumerate(zip(minRegionSizes,distThs,distConfs)):
-        for (oI,overlapTh) in enumerate(overlaps):
-            for (lI,labelName) in enumerate(args.instLabels):
-                y_true   = np.empty( 0 )
-                y_score  = np.empty( 0 )
-                # count hard false negatives
-                hardFns  = 0
-                # found at least one gt and predicted instance?
-                haveGt   = False
-                havePred = False
-
-                for img in matches:
-                    predInstances = matches[img]["prediction" ][labelName]
-                    gtInstances   = matches[img]["groundTruth"][labelName]
-                    # filter groups in ground truth
-                    gtInstances   = [ gt for gt in gtInstances if gt["instID"]>=1000 and gt["pixelCount"]>=minRegionSize and gt["medDist"]<=distanceTh and gt["distConf"]>=distanceConf ]
-
-                    if gtInstances:
-                        haveGt = True
-                    if predInstances:
-                        havePred = True
-
-                    curTrue  = np.ones ( len(gtInstances) )
-                    curScore = np.ones ( len(gtInstances) ) * (-float("inf"))
-                    curMatch = np.zeros( len(gtInstances) , dtype=bool )
-
-                    # collect matches
-                    for (gtI,gt) in enumerate(gtInstances):
-                        foundMatch = False
-                        for pred in gt["matchedPred"]:
-                            overlap = float(pred["intersection"]) / (gt["pixelCount"]+pred["pixelCount"]-pred["intersection"])
-                            if overlap > overlapTh:
-                                # the score
-                                confidence = pred["confidence"]
-
-                                # if we already hat a prediction for this groundtruth
-                                # the prediction with the lower score is automatically a false positive
-                                if curMatch[gtI]:
-                                    maxScore = max( curScore[gtI] , confidence )
-                                    minScore = min( curScore[gtI] , confidence )
-                                    curScore[gtI] = maxScore
-                                    # append false positive
-                                    curTrue  = np.append(curTrue,0)
-                                    curScore = np.append(curScore,minScore)
-                                    curMatch = np.append(curMatch,True)
-                                # otherwise set score
-                                else:
-                                    foundMatch = True
-                                    curMatch[gtI] = True
-                                    curScore[gtI] = confidence
-
-                        if not foundMatch:
-                            hardFns += 1
-
-                    # remove non-matched ground truth instances
-                    curTrue  = curTrue [ curMatch==True ]
-                    curScore = curScore[ curMatch==True ]
-
-                    # collect non-matched predictions as false positive
-                    for pred in predInstances:
-                        foundGt = False
-                        for gt in pred["matchedGt"]:
-                            overlap = float(gt["intersection"]) / (gt["pixelCount"]+pred["pixelCount"]-gt["intersection"])
-                            if overlap > overlapTh:
-                                foundGt = True
-                                break
-                        if not foundGt:
-                            # collect number of void and *group pixels
-                            nbIgnorePixels = pred["voidIntersection"]
-                            for gt in pred["matchedGt"]:
-                                # group?
-                                if gt["instID"] < 1000:
-                                    nbIgnorePixels += gt["intersection"]
-                                # small ground truth instances
-                                if gt["pixelCount"] < minRegionSize or gt["medDist"]>distanceTh or gt["distConf"]<distanceConf:
-                                    nbIgnorePixels += gt["intersection"]
-                            proportionIgnore = float(nbIgnorePixels)/pred["pixelCount"]
-                            # if not ignored
-                            # append false positive
-                            if proportionIgnore <= overlapTh:
-                                curTrue = np.append(curTrue,0)
-                                confidence = pred["confidence"]
-                                curScore = np.append(curScore,confidence)
-
-                    # append to overall results
-                    y_true  = np.append(y_true,curTrue)
-                    y_score = np.append(y_score,curScore)
+    gtTable   = matchTable.gt
+    predTable = matchTable.pred
+    pairTable = matchTable.pair
+    pairGt    = gtTable  [ pairTable["gt"  ] ]
+    pairPred  = predTable[ pairTable["pred"] ]
+
+    # overlap of every pair and whether it satisfies each overlap threshold
+    pairOverlap = pairTable["intersection"] / (pairGt["pixelCount"] + pairPred["pixelCount"] - pairTable["intersection"])
+    pairMatched = pairOverlap[:,np.newaxis] > overlaps[np.newaxis,:]
 
+    # a prediction is not matched at a threshold, if none of its pairs exceeds it
+    predMaxOverlap = np.full( len(predTable) , -float("inf") )
+    np.maximum.at( predMaxOverlap , pairTable["pred"] , pairOverlap )
+    predNotMatched = predMaxOverlap[:,np.newaxis] <= overlaps[np.newaxis,:]
+
+    for dI,(minRegionSize,distanceTh,distanceConf) in enumerate(zip(minRegionSizes,distThs,distConfs)):
+        # filter groups, small and distant instances in ground truth
+        gtValid = ( (gtTable["instID"]     >= 1000         ) &
+                    (gtTable["pixelCount"] >= minRegionSize) &
+                    (gtTable["medDist"]    <= distanceTh   ) &
+                    (gtTable["distConf"]   >= distanceConf ) )
+
+        # collect number of void, *group and filtered ground truth pixels per prediction
+        gtIgnored = ( (pairGt["pixelCount"] <  minRegionSize) |
+                      (pairGt["medDist"]    >  distanceTh   ) |
+                      (pairGt["distConf"]   <  distanceConf ) )
+        pairIgnorePixels = pairTable["intersection"] * ( (pairGt["instID"] < 1000).astype(np.int64) + gtIgnored )
+        nbIgnorePixels   = predTable["voidIntersection"].copy()
+        np.add.at( nbIgnorePixels , pairTable["pred"] , pairIgnorePixels )
+        proportionIgnore = nbIgnorePixels / predTable["pixelCount"]
+
+        # non-matched predictions that are not ignored are false positives
+        predFalsePos = predNotMatched & ( proportionIgnore[:,np.newaxis] <= overlaps[np.newaxis,:] )
+
+        for (lI,labelName) in enumerate(args.instLabels):
+            labelID  = name2label[labelName].id
+            gtOfLabel   = gtValid & (gtTable["labelID"] == labelID)
+            predOfLabel = predTable["labelID"] == labelID
+
+            # found at least one gt and predicted instance?
+            haveGt   = bool(np.any(gtOfLabel  ))
+            havePred = bool(np.any(predOfLabel))
+
+            # pairs of the kept gt instances, sorted by gt and descending confidence
+            pairSel   = gtOfLabel[ pairTable["gt"] ]
+            selGt     = pairTable["gt"]        [pairSel]
+            selConf   = pairPred["confidence"] [pairSel]
+            selMatch  = pairMatched            [pairSel]
+            pairOrder = np.lexsort( ( -selConf , selGt ) )
+            selGt     = selGt   [pairOrder]
+            selConf   = selConf [pairOrder]
+            selMatch  = selMatch[pairOrder]
+
+            # rank of each matching prediction among those of the same gt instance
+            # the best scoring one is the match, all others are false positives
+            groupStart = np.ones( len(selGt) , dtype=bool )
+            groupStart[1:] = selGt[1:] != selGt[:-1]
+            groupIdx   = np.cumsum(groupStart) - 1
+            matchCum   = np.cumsum( selMatch , axis=0 )
+            matchRank  = matchCum - (matchCum - selMatch)[groupStart][groupIdx]
+            isMatch    = selMatch & (matchRank == 1)
+            isDupFalse = selMatch & (matchRank >  1)
+
+            # count hard false negatives
+            hardFns = np.count_nonzero(gtOfLabel) - np.count_nonzero(isMatch, axis=0)
+
+            labelFalsePos = predFalsePos[predOfLabel]
+            labelPredConf = predTable["confidence"][predOfLabel]
+
+            for (oI,overlapTh) in enumerate(overlaps):
                 # compute the average precision
                 if haveGt and havePred:
-                    # compute precision recall curve first
-
-                    # sorting and cumsum
-                    scoreArgSort      = np.argsort(y_score)
-                    yScoreSorted      = y_score[scoreArgSort]
-                    yTrueSorted       = y_true[scoreArgSort]
-                    yTrueSortedCumsum = np.cumsum(yTrueSorted)
-
-                    # unique thresholds
-                    (thresholds,uniqueIndices) = np.unique( yScoreSorted , return_index=True )
-
-                    # since we need to add an artificial point to the precision-recall curve
-                    # increase its length by 1
-                    nbPrecRecall = len(uniqueIndices) + 1
-
-                    # prepare precision recall
-                    nbExamples     = len(yScoreSorted)
-                    nbTrueExamples = yTrueSortedCumsum[-1]
-                    precision      = np.zeros(nbPrecRecall)
-                    recall         = np.zeros(nbPrecRecall)
-
-                    # deal with the first point
-                    # only thing we need to do, is to append a zero to the cumsum at the end.
-                    # an index of -1 uses that zero then
-                    yTrueSortedCumsum = np.append( yTrueSortedCumsum , 0 )
-
-                    # deal with remaining
-                    for idxRes,idxScores in enumerate(uniqueIndices):
-                        cumSum = yTrueSortedCumsum[idxScores-1]
-                        tp = nbTrueExamples - cumSum
-                        fp = nbExamples     - idxScores - tp
-                        fn = cumSum + hardFns
-                        p  = float(tp)/(tp+fp)
-                        r  = float(tp)/(tp+fn)
-                        precision[idxRes] = p
-                        recall   [idxRes] = r
-
-                    # first point in curve is artificial
-                    precision[-1] = 1.
-                    recall   [-1] = 0.
-
-                    # compute average of precision-recall curve
-                    # integration is performed via zero order, or equivalently step-wise integration
-                    # first compute the widths of each step:
-                    # use a convolution with appropriate kernel, manually deal with the boundaries first
-                    recallForConv = np.copy(recall)
-                    recallForConv = np.append( recallForConv[0] , recallForConv )
-                    recallForConv = np.append( recallForConv    , 0.            )
-
-                    stepWidths = np.convolve(recallForConv,[-0.5,0,0.5],'valid')
-
-                    # integrate is now simply a dot product
-                    apCurrent = np.dot( precision , stepWidths )
+                    y_score = np.concatenate( ( selConf      [isMatch   [:,oI]] ,
+                                                selConf      [isDupFalse[:,oI]] ,
+                                                labelPredConf[labelFalsePos[:,oI]] ) )
+                    y_true  = np.zeros( len(y_score) )
+                    y_true[:np.count_nonzero(isMatch[:,oI])] = 1.
 
+                    apCurrent = computeAveragePrecision(y_true, y_score, hardFns[oI])
                 elif haveGt:
                     apCurrent = 0.0
                 else:
@@ -555,6 +990,60 @@ def evaluateMatches(matches, args):
 
     return ap
 
+# Average precision from the binary ground truth vector, the prediction scores
+# and the number of ground truth instances without any prediction
+def computeAveragePrecision(y_true, y_score, hardFns):
+    # compute precision recall curve first
+
+    # sorting and cumsum
+    scoreArgSort      = np.argsort(y_score)
+    yScoreSorted      = y_score[scoreArgSort]
+    yTrueSorted       = y_true[scoreArgSort]
+    yTrueSortedCumsum = np.cumsum(yTrueSorted)
+
+    # unique thresholds
+    (thresholds,uniqueIndices) = np.unique( yScoreSorted , return_index=True )
+
+    # since we need to add an artificial point to the precision-recall curve
+    # increase its length by 1
+    nbPrecRecall = len(uniqueIndices) + 1
+
+    # prepare precision recall
+    nbExamples     = len(yScoreSorted)
+    nbTrueExamples = yTrueSortedCumsum[-1]
+    precision      = np.zeros(nbPrecRecall)
+    recall         = np.zeros(nbPrecRecall)
+
+    # deal with the first point
+    # only thing we need to do, is to append a zero to the cumsum at the end.
+    # an index of -1 uses that zero then
+    yTrueSortedCumsum = np.append( yTrueSortedCumsum , 0 )
+
+    # deal with remaining
+    cumSum = yTrueSortedCumsum[uniqueIndices-1]
+    tp = nbTrueExamples - cumSum
+    fp = nbExamples     - uniqueIndices - tp
+    fn = cumSum + hardFns
+    precision[:-1] = tp/(tp+fp)
+    recall   [:-1] = tp/(tp+fn)
+
+    # first point in curve is artificial
+    precision[-1] = 1.
+    recall   [-1] = 0.
+
+    # compute average of precision-recall curve
+    # integration is performed via zero order, or equivalently step-wise integration
+    # first compute the widths of each step:
+    # use a convolution with appropriate kernel, manually deal with the boundaries first
+    recallForConv = np.copy(recall)
+    recallForConv = np.append( recallForConv[0] , recallForConv )
+    recallForConv = np.append( recallForConv    , 0.            )
+
+    stepWidths = np.convolve(recallForConv,[-0.5,0,0.5],'valid')
+
+    # integrate is now simply a dot product
+    return np.dot( precision , stepWidths )
+
 def computeAverages(aps,args):
     # max distance index
     dInf  = np.argmax( args.distanceThs )
@@ -659,16 +1148,23 @@ def prepareJSONDataForResults(avgDict, aps, args):
     return JSONData
 
 # Work through image list
+# The labels of interest are given by args.instLabels
 def evaluateImgLists(predictionList, groundTruthList, args):
-    # determine labels of interest
-    setInstanceLabels(args)
     # get dictionary of all ground truth instances
     gtInstances = getGtInstances(groundTruthList,args)
     # match predictions and ground truth
-    matches = matchGtWithPreds(predictionList,groundTruthList,gtInstances,args)
-    writeDict2JSON(matches,"matches.json")
+    matchTable = streamMatches(predictionList,groundTruthList,gtInstances,args)
+    if args.matchesFile:
+        # keep the matches for re-scoring with other parameters
+        ensurePath(os.path.dirname(args.matchesFile))
+        matchTable.save(args.matchesFile)
+
+    return evaluateMatchTable(matchTable, args)
+
+# Compute all results from a table of matches
+def evaluateMatchTable(matchTable, args):
     # evaluate matches
-    apScores = evaluateMatches(matches, args)
+    apScores = evaluateMatches(matchTable, args)
     # averages
     avgDict = computeAverages(apScores,args)
     # result dict
@@ -686,9 +1182,13 @@ def evaluateImgLists(predictionList, groundTruthList, args):
 
     return resDict
 
+# Re-compute the results from matches stored by evaluateImgLists,
+# without reading any image again
+def evaluateMatchesFile(matchesFile, args):
+    return evaluateMatchTable(MatchTable.load(matchesFile), args)
+
 # The main method
 def main():
-    global args
     argv = sys.argv[1:]
 
     predictionImgList = []
@@ -708,12 +1208,11 @@ def main():
         if not groundTruthImgList:
             printError("Cannot find any ground truth images to use for evaluation. Searched for: {}".format(args.groundTruthSearch))
         # get the corresponding prediction for each ground truth imag
-        for gt in groundTruthImgList:
-            predictionImgList.append( getPrediction(gt,args) )
+        predictionImgList = getPredictions(groundTruthImgList,args)
 
     # print some info for user
     print("Note that this tool uses the file '{}' to cache the ground truth instances.".format(args.gtInstancesFile))
-    print("If anything goes wrong, or if you change the ground truth, please delete the file.")
+    print("Changed ground truth images are detected automatically. If anything goes wrong, please delete the file.")
 
     # evaluate
     evaluateImgLists(predictionImgList, groundTruthImgList, args)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Decoded ground truth images in shared memory, for scoring many submissions
+#
+
+from __future__ import print_function, absolute_import, division
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+# Cityscapes imports
+from .helpers.workerPool import mapInWorkers
+
+
+# Decode a ground truth image into a numpy array
+def decodeGtImage(gtImageFileName):
+    return np.array(Image.open(gtImageFileName))
+
+
+# All images are decoded once and copied into a single shared memory block.
+# The store is sent to worker processes by the name of the block only, the
+# workers map the block when they first read an image and get read-only
+# views, such that the images exist once, no matter how many workers read
+# them. The process that created the store has to close it.
+class SharedGtImages(object):
+    def __init__(self, gtImageFileList, workers=1):
+        gtImageFileList = [ os.path.abspath(str(gt)) for gt in gtImageFileList ]
+        images = list( mapInWorkers(decodeGtImage, gtImageFileList, workers) )
+
+        # image -> (offset, shape, dtype)
+        self.index = {}
+        offset = 0
+        for (gt,image) in zip(gtImageFileList,images):
+            self.index[gt] = ( offset , image.shape , image.dtype.str )
+            # keep every image aligned to 8 bytes
+            offset += ( image.nbytes + 7 ) // 8 * 8
+
+        self._memory = shared_memory.SharedMemory(create=True, size=max(offset,1))
+        self.name    = self._memory.name
+        self._owner  = True
+        for (gt,image) in zip(gtImageFileList,images):
+            self._view(gt)[...] = image
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memory"] = None
+        state["_owner"]  = False
+        return state
+
+    def _view(self, gtImageFileName):
+        if self._memory is None:
+            self._memory = shared_memory.SharedMemory(name=self.name)
+        (offset,shape,dtype) = self.index[gtImageFileName]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._memory.buf, offset=offset)
+
+    # The decoded image, or None if it is not in the store
+    def getImage(self, gtImageFileName):
+        gtImageFileName = os.path.abspath(str(gtImageFileName))
+        if not gtImageFileName in self.index:
+            return None
+        image = self._view(gtImageFileName)
+        image.flags.writeable = False
+        return image
+
+    # Release the shared memory, the store must not be used afterwards
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            if self._owner:
+                self._memory.unlink()
+            self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#
+# Binary cache of the ground truth instances, validated per image
+#
+
+from __future__ import print_function, absolute_import, division
+import os
+
+import numpy as np
+
+# Cityscapes imports
+from .helpers.csHelpers import fileHash
+from .helpers.cacheFile import loadCacheArrays, saveCacheArrays
+from .helpers.labels import labels, id2label
+
+
+# Bump whenever the layout of the cache changes, older caches are rebuilt
+CACHE_VERSION = 2
+
+# Fingerprint of a ground truth image
+# The hash is only computed if size or modification time changed
+FILE_DTYPE = np.dtype([
+    ("size"       , np.int64  ),
+    ("mtime"      , np.int64  ),
+    ("hash"       , "S32"     ),
+])
+
+# One row per ground truth instance
+INSTANCE_DTYPE = np.dtype([
+    ("instID"     , np.int32  ),
+    ("labelID"    , np.int32  ),
+    ("pixelCount" , np.int64  ),
+    ("medDist"    , np.float64),
+    ("distConf"   , np.float64),
+    # bounding box [y0,y1) x [x0,x1)
+    ("y0"         , np.int32  ),
+    ("x0"         , np.int32  ),
+    ("y1"         , np.int32  ),
+    ("x1"         , np.int32  ),
+])
+
+
+# The ground truth instances of all images in a single npz file
+# Images are stored relative to the folder of the cache file, such that
+# the cache stays valid if the folder is moved as a whole.
+class GtInstancesCache(object):
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.cacheDir  = os.path.dirname(os.path.abspath(cacheFile))
+        # relative image name -> (fingerprint, instance rows)
+        self.entries   = {}
+        self.modified  = False
+
+    def load(self):
+        data = loadCacheArrays(self.cacheFile, CACHE_VERSION, ("names","files","offsets","instances"))
+        if data is None:
+            return False
+        names     = data["names"]
+        files     = data["files"]
+        offsets   = data["offsets"]
+        instances = data["instances"]
+
+        for (i,name) in enumerate(names):
+            self.entries[str(name)] = ( files[i] , instances[offsets[i]:offsets[i+1]] )
+        return True
+
+    def save(self):
+        names     = sorted(self.entries)
+        files     = np.array( [ self.entries[name][0] for name in names ] , dtype=FILE_DTYPE )
+        counts    = [ len(self.entries[name][1]) for name in names ]
+        offsets   = np.zeros( len(names) + 1 , dtype=np.int64 )
+        offsets[1:] = np.cumsum(counts)
+        if names:
+            instances = np.concatenate( [ self.entries[name][1] for name in names ] ).astype(INSTANCE_DTYPE)
+        else:
+            instances = np.empty( 0 , dtype=INSTANCE_DTYPE )
+
+        saveCacheArrays( self.cacheFile , CACHE_VERSION ,
+                         names     = np.array(names, dtype=str) ,
+                         files     = files ,
+                         offsets   = offsets ,
+                         instances = instances )
+        self.modified = False
+
+    def _key(self, imageFileName):
+        imageFileName = os.path.abspath(imageFileName)
+        try:
+            return os.path.relpath(imageFileName, self.cacheDir)
+        except ValueError:
+            # e.g. on another drive
+            return imageFileName
+
+    # Check whether the cached instances of an image are still up to date
+    def isValid(self, imageFileName):
+        key = self._key(imageFileName)
+        if not key in self.entries:
+            return False
+        (fingerprint,instances) = self.entries[key]
+        stat = os.stat(imageFileName)
+        if stat.st_size != fingerprint["size"]:
+            return False
+        if stat.st_mtime_ns == fingerprint["mtime"]:
+            return True
+        # same size but touched, compare the content
+        if fileHash(imageFileName) != fingerprint["hash"]:
+            return False
+        fingerprint = fingerprint.copy()
+        fingerprint["mtime"] = stat.st_mtime_ns
+        self.entries[key] = ( fingerprint , instances )
+        self.modified = True
+        return True
+
+    # Store the instances of a dictionary created by instances2dict
+    def update(self, instanceDict):
+        for imageFileName in instanceDict:
+            rows = []
+            for labelName in instanceDict[imageFileName]:
+                for inst in instanceDict[imageFileName][labelName]:
+                    rows.append( ( inst["instID"] , inst["labelID"] , inst["pixelCount"] , inst["medDist"] , inst["distConf"] ) + tuple(inst["bbox"]) )
+            stat = os.stat(imageFileName)
+            fingerprint = np.array( ( stat.st_size , stat.st_mtime_ns , fileHash(imageFileName) ) , dtype=FILE_DTYPE )
+            self.entries[self._key(imageFileName)] = ( fingerprint , np.array(rows, dtype=INSTANCE_DTYPE) )
+        self.modified = True
+
+    # The instances of an image in the format of instances2dict
+    def getInstances(self, imageFileName):
+        instances = {}
+        for label in labels:
+            instances[label.name] = []
+        for row in self.entries[self._key(imageFileName)][1]:
+            inst = {}
+            inst["instID"]     = int  (row["instID"]    )
+            inst["labelID"]    = int  (row["labelID"]   )
+            inst["pixelCount"] = int  (row["pixelCount"])
+            inst["medDist"]    = float(row["medDist"]   )
+            inst["distConf"]   = float(row["distConf"]  )
+            inst["bbox"]       = [ int(row["y0"]) , int(row["x0"]) , int(row["y1"]) , int(row["x1"]) ]
+            instances[id2label[inst["labelID"]].name].append(inst)
+        return instances
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+#
+# Reading and writing of the versioned npz files of the caches
+#
+
+from __future__ import print_function, absolute_import, division
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+def loadCacheArrays(cacheFile, version, names):
+    """Returns a dictionary of the named arrays of a cache file, or None if
+    the file is missing, unreadable or of another version"""
+    if not os.path.isfile(cacheFile):
+        return None
+    try:
+        with np.load(cacheFile, allow_pickle=False) as data:
+            if int(data["version"]) != version:
+                return None
+            return { name : data[name] for name in names }
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # unreadable cache, everything is recomputed
+        return None
+
+
+def saveCacheArrays(cacheFile, version, **arrays):
+    """Write the arrays to a cache file, replacing it at once such that
+    readers and concurrent writers never see a half written cache"""
+    cacheDir = os.path.dirname(os.path.abspath(cacheFile))
+    (fd,tmpFile) = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez( f , version=np.array(version) , **arrays )
+        os.replace(tmpFile, cacheFile)
+    except BaseException:
+        os.unlink(tmpFile)
+        raise
@@ -9,6 +9,7 @@ import os
 import sys
 import math
 import json
+import hashlib
 from collections import namedtuple
 
 def printError(message):
@@ -106,3 +107,12 @@ def writeDict2JSON(dictName, fileName):
     """Write a dictionary as json file"""
     with open(fileName, 'w') as f:
         f.write(json.dumps(dictName, default=lambda o: o.__dict__, sort_keys=True, indent=4))
+
+
+def fileHash(fileName):
+    """Returns a hash of the content of the given file as ascii bytes"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest().encode("ascii")
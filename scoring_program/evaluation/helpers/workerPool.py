@@ -0,0 +1,23 @@
+#!/usr/bin/python
+#
+# Mapping a function over many items in worker processes
+#
+
+from __future__ import print_function, absolute_import, division
+from concurrent.futures import ProcessPoolExecutor
+
+
+def mapInWorkers(function, items, workers=1, initializer=None, initargs=()):
+    """Apply the function to all items, in worker processes if more than one
+    worker is given. The results are returned lazily and in the order of the
+    items, the workers are shut down once all results are taken."""
+    if workers <= 1 or len(items) <= 1:
+        for result in map(function, items):
+            yield result
+        return
+
+    # send the items in chunks to keep the pickling overhead small
+    chunkSize = max( 1 , len(items) // (workers * 4) )
+    with ProcessPoolExecutor( max_workers=workers , initializer=initializer , initargs=initargs ) as executor:
+        for result in executor.map( function , items , chunksize=chunkSize ):
+            yield result
@@ -10,13 +10,20 @@ class Instance(object):
     pixelCount = 0
     medDist    = -1
     distConf   = 0.0
+    bbox       = None
 
-    def __init__(self, imgNp, instID):
+    def __init__(self, imgNp, instID, pixelCount=None, bbox=None):
         if (instID == -1):
             return
         self.instID     = int(instID)
         self.labelID    = int(self.getLabelID(instID))
-        self.pixelCount = int(self.getInstancePixels(imgNp, instID))
+        # the pixel count can be passed if it is already known
+        if pixelCount is None:
+            pixelCount = self.getInstancePixels(imgNp, instID)
+        self.pixelCount = int(pixelCount)
+        # the bounding box (y0,x0,y1,x1) can be passed if it is already known
+        if bbox is not None:
+            self.bbox   = [ int(b) for b in bbox ]
 
     def getLabelID(self, instID):
         if (instID < 1000):
@@ -37,6 +44,8 @@ class Instance(object):
         buildDict["pixelCount"] = self.pixelCount
         buildDict["medDist"]    = self.medDist
         buildDict["distConf"]   = self.distConf
+        if self.bbox is not None:
+            buildDict["bbox"]   = self.bbox
         return buildDict
 
     def fromJSON(self, data):
@@ -46,6 +55,8 @@ class Instance(object):
         if ("medDist" in data):
             self.medDist    = float(data["medDist"])
             self.distConf   = float(data["distConf"])
+        if ("bbox" in data):
+            self.bbox       = [ int(b) for b in data["bbox"] ]
 
     def __str__(self):
         return "("+str(self.instID)+")"
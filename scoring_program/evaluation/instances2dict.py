@@ -12,8 +12,9 @@ from PIL import Image
 # Cityscapes imports
 from .instance import Instance
 from .helpers.labels import id2label, labels
+from .helpers.workerPool import mapInWorkers
 
-def instances2dict(imageFileList, verbose=False):
+def instances2dict(imageFileList, verbose=False, workers=1):
     imgCount     = 0
     instanceDict = {}
 
@@ -23,24 +24,9 @@ def instances2dict(imageFileList, verbose=False):
     if verbose:
         print("Processing {} images...".format(len(imageFileList)))
 
-    for imageFileName in imageFileList:
-        # Load image
-        img = Image.open(imageFileName)
-
-        # Image as numpy array
-        imgNp = np.array(img)
-
-        # Initialize label categories
-        instances = {}
-        for label in labels:
-            instances[label.name] = []
-
-        # Loop through all instance ids in instance image
-        for instanceId in np.unique(imgNp):
-            instanceObj = Instance(imgNp, instanceId)
-
-            instances[id2label[instanceObj.labelID].name].append(instanceObj.toDict())
-
+    # decode the images in parallel, the results keep their order
+    results = mapInWorkers(image2instances, imageFileList, workers)
+    for (imageFileName,instances) in zip(imageFileList,results):
         imgKey = os.path.abspath(imageFileName)
         instanceDict[imgKey] = instances
         imgCount += 1
@@ -54,6 +40,45 @@ def instances2dict(imageFileList, verbose=False):
 
     return instanceDict
 
+# All instances of a single image
+def image2instances(imageFileName):
+    # Load image
+    img = Image.open(imageFileName)
+
+    # Image as numpy array
+    imgNp = np.array(img)
+
+    # Initialize label categories
+    instances = {}
+    for label in labels:
+        instances[label.name] = []
+
+    # Loop through all instance ids in instance image
+    # the pixel counts and bounding boxes of all instances come from the same pass
+    (instanceIds,inverse,pixelCounts) = np.unique(imgNp, return_inverse=True, return_counts=True)
+    bboxes = instanceBoundingBoxes(inverse.reshape(imgNp.shape), len(instanceIds))
+    for (instanceId,pixelCount,bbox) in zip(instanceIds,pixelCounts,bboxes):
+        instanceObj = Instance(imgNp, instanceId, pixelCount, bbox)
+
+        instances[id2label[instanceObj.labelID].name].append(instanceObj.toDict())
+
+    return instances
+
+# The bounding boxes (y0,x0,y1,x1) of all indices of an image, where every
+# index in [0,nbIndices) has to occur at least once
+def instanceBoundingBoxes(indexNp, nbIndices):
+    (height,width) = indexNp.shape
+    # mark the rows and the columns every index occurs in
+    rowsHit = np.zeros( (height,nbIndices) , dtype=bool )
+    colsHit = np.zeros( (width ,nbIndices) , dtype=bool )
+    rowsHit[ np.arange(height)[:,None] , indexNp ] = True
+    colsHit[ np.arange(width )[None,:] , indexNp ] = True
+    y0 = rowsHit.argmax(axis=0)
+    x0 = colsHit.argmax(axis=0)
+    y1 = height - rowsHit[::-1].argmax(axis=0)
+    x1 = width  - colsHit[::-1].argmax(axis=0)
+    return np.stack( (y0,x0,y1,x1) , axis=1 )
+
 def main(argv):
     fileList = []
     if (len(argv) > 2):
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Wall time, call counts and throughput of the stages of the scoring pipeline
+#
+
+from __future__ import print_function, absolute_import, division
+import contextvars
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+# The stages of a single evaluation
+# stage name -> { "calls" , "seconds" , "images" }
+class StageRecorder(object):
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, name, seconds, images=0, calls=1):
+        stage = self.stages.setdefault(name, { "calls" : 0 , "seconds" : 0. , "images" : 0 })
+        stage["calls"]   += calls
+        stage["seconds"] += seconds
+        stage["images"]  += images
+
+    # Add the stages collected in another process
+    def merge(self, stages):
+        for (name,stage) in stages.items():
+            self.record(name, stage["seconds"], stage["images"], stage["calls"])
+
+    # A dictionary of all stages, ready to be written as JSON
+    # Stages running in worker processes sum up the time of all workers
+    def report(self):
+        report = { "stages" : {} }
+        for (name,stage) in sorted(self.stages.items()):
+            entry = dict(stage)
+            if stage["images"]:
+                entry["imagesPerSecond"] = stage["images"] / stage["seconds"] if stage["seconds"] else None
+            report["stages"][name] = entry
+        (report["peakRssMB"],report["peakRssChildrenMB"]) = peakRss()
+        return report
+
+# The recorder of the running evaluation, every thread starts without one
+# such that evaluations running side by side keep their stages apart
+_recorder = contextvars.ContextVar("stageRecorder", default=None)
+
+# Record the stages of the calls inside the with block in a new recorder
+# Used as decorator, every call of the function gets its own recorder
+@contextmanager
+def recordStages():
+    recorder = StageRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+# Stages outside of recordStages are not recorded
+def recordStage(name, seconds, images=0, calls=1):
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.record(name, seconds, images, calls)
+
+# Add the stages collected in another process to the running evaluation
+def mergeStages(stages):
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.merge(stages)
+
+# Decorator recording the wall time of every call of a function as stage
+# The processed images are either a fixed number per call, or computed
+# from the arguments of the call
+def timed(name, images=0):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                count = images(*args, **kwargs) if callable(images) else images
+                recordStage(name, time.perf_counter() - start, count)
+        return wrapper
+    return decorator
+
+# Peak resident set size in MB of this process and of all its finished
+# child processes, or None if unknown
+def peakRss():
+    if resource is None:
+        return ( None , None )
+    # ru_maxrss is given in kilobytes on Linux
+    return ( resource.getrusage(resource.RUSAGE_SELF    ).ru_maxrss / 1024. ,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024. )
+
+# The report of the stages of the running evaluation
+def stageReport():
+    recorder = _recorder.get()
+    return ( recorder or StageRecorder() ).report()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# Intersection engine for matching predicted masks with ground truth instances
+#
+
+from __future__ import print_function, absolute_import, division
+import numpy as np
+
+# Cityscapes imports
+from .helpers.labels import labels
+from .rle import runIndices
+
+
+# Whether two bounding boxes (y0,x0,y1,x1) overlap, an unknown box overlaps everything
+def boxesOverlap(boxA, boxB):
+    if boxA is None or boxB is None:
+        return True
+    return ( boxA[0] < boxB[2] and boxB[0] < boxA[2] and
+             boxA[1] < boxB[3] and boxB[1] < boxA[3] )
+
+
+# Every pixel of the ground truth image is assigned to one bin:
+#   0   : pixel neither void nor part of a ground truth instance of interest
+#   1   : void pixel, i.e. its label is ignored in evaluation
+#   2.. : pixel of the n-th ground truth instance (in order of gtInstances)
+# Counting the bins of all pixels covered by a prediction mask then yields
+# the void intersection and all instance intersections in a single pass.
+class GtIntersectionEngine(object):
+    BACKGROUND_BIN = 0
+    VOID_BIN       = 1
+
+    def __init__(self, gtNp, gtInstances):
+        # all instance ids that get their own bin
+        instIDs = []
+        for labelName in gtInstances:
+            for gtInstance in gtInstances[labelName]:
+                instIDs.append(int(gtInstance["instID"]))
+
+        voidLabelIDs = [ label.id for label in labels if label.ignoreInEval and label.id >= 0 ]
+
+        self.nbBins = len(instIDs) + 2
+        self.instBins = {}
+        for (num,instID) in enumerate(instIDs):
+            self.instBins[instID] = num + 2
+
+        self.binNp = self._buildBinMap(gtNp, voidLabelIDs, instIDs)
+        # bin map in column-major order, created for the first run-length encoded mask
+        self._binFlatF = None
+
+    def _buildBinMap(self, gtNp, voidLabelIDs, instIDs):
+        binDtype = np.uint8 if self.nbBins <= np.iinfo(np.uint8).max else np.int32
+        maxID = int(gtNp.max()) if gtNp.size else 0
+        if gtNp.size and int(gtNp.min()) < 0:
+            # negative ids cannot index a lookup table, map over the unique ids instead
+            (uniqueIDs,inverse) = np.unique(gtNp, return_inverse=True)
+            lookup = np.zeros(len(uniqueIDs), dtype=binDtype)
+            lookup[np.isin(uniqueIDs, voidLabelIDs)] = self.VOID_BIN
+            for instID in instIDs:
+                lookup[uniqueIDs == instID] = self.instBins[instID]
+            return lookup[inverse].reshape(gtNp.shape)
+
+        lookup = np.zeros(maxID + 1, dtype=binDtype)
+        for voidID in voidLabelIDs:
+            if voidID <= maxID:
+                lookup[voidID] = self.VOID_BIN
+        for instID in instIDs:
+            if instID <= maxID:
+                lookup[instID] = self.instBins[instID]
+        return lookup[gtNp]
+
+    # Count the pixels of a boolean prediction mask per bin
+    # If a bounding box (y0,x0,y1,x1) is given, the mask covers only that box
+    def intersect(self, boolPredInst, bbox=None):
+        binNp = self.binNp
+        if bbox is not None:
+            (y0,x0,y1,x1) = bbox
+            binNp = binNp[y0:y1,x0:x1]
+        return np.bincount(binNp[boolPredInst], minlength=self.nbBins)
+
+    # Count the pixels of a run-length encoded prediction mask per bin
+    # The runs index the frame in column-major order, see rle.foregroundRuns
+    def intersectRuns(self, starts, lengths):
+        if self._binFlatF is None:
+            self._binFlatF = np.ravel(self.binNp, order='F')
+        return np.bincount(self._binFlatF[runIndices(starts, lengths)], minlength=self.nbBins)
+
+    # Count the pixels of many non-overlapping prediction masks per bin at once
+    # predRowNp holds for every pixel the row of its prediction, where row 0
+    # collects all pixels without a prediction of interest
+    # The result has one row of bin counts per prediction
+    def intersectRows(self, predRowNp, nbRows):
+        pairs = predRowNp.astype(np.int64).ravel() * self.nbBins + self.binNp.ravel()
+        return np.bincount(pairs, minlength=nbRows * self.nbBins).reshape(nbRows, self.nbBins)
+
+    # Number of prediction pixels on void ground truth
+    def voidIntersection(self, binCounts):
+        return int(binCounts[self.VOID_BIN])
+
+    # Number of prediction pixels on the given ground truth instance
+    def instanceIntersection(self, binCounts, instID):
+        return int(binCounts[self.instBins[int(instID)]])
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# Store of decoded prediction masks as packed bits in a memory-mapped file
+#
+
+from __future__ import print_function, absolute_import, division
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+# Cityscapes imports
+from .helpers.csHelpers import fileHash
+from .helpers.cacheFile import loadCacheArrays, saveCacheArrays
+from .helpers.workerPool import mapInWorkers
+
+
+# Bump whenever the layout of the store changes, older stores are rebuilt
+STORE_VERSION = 2
+
+# One row per mask
+# The mask is cropped to its bounding box [y0,y1) x [x0,x1) and every row
+# of the crop is packed with np.packbits, starting at byte "offset" of the
+# data file. Empty masks have an empty bounding box and no data.
+# Size, modification time and hash of the mask file tell whether the file
+# changed since the store was built, the hash is only computed if size or
+# modification time changed.
+INDEX_DTYPE = np.dtype([
+    ("offset"     , np.int64),
+    ("y0"         , np.int32),
+    ("x0"         , np.int32),
+    ("y1"         , np.int32),
+    ("x1"         , np.int32),
+    ("height"     , np.int32),
+    ("width"      , np.int32),
+    ("pixelCount" , np.int64),
+    ("size"       , np.int64),
+    ("mtime"      , np.int64),
+    ("hash"       , "S32"   ),
+])
+
+
+# Decode a binary mask image, given as file name or binary file object
+# Everything non-zero is part of the prediction
+def decodeMask(predImageFile):
+    predImage = Image.open(predImageFile)
+    predImage = predImage.convert("L")
+    return np.array(predImage) != 0
+
+# Bounding box of a binary mask as (y0,x0,y1,x1)
+def maskBoundingBox(boolMask):
+    rows = np.flatnonzero(np.any(boolMask, axis=1))
+    if not len(rows):
+        return (0,0,0,0)
+    cols = np.flatnonzero(np.any(boolMask, axis=0))
+    return ( int(rows[0]) , int(cols[0]) , int(rows[-1]) + 1 , int(cols[-1]) + 1 )
+
+# Decode a mask and pack its bounding box crop
+def _packMask(predImageFile):
+    boolMask = decodeMask(predImageFile)
+    (y0,x0,y1,x1) = maskBoundingBox(boolMask)
+    packed = np.packbits(boolMask[y0:y1,x0:x1], axis=1)
+    stat = os.stat(predImageFile)
+    return ( (y0,x0,y1,x1) , boolMask.shape , int(np.count_nonzero(boolMask)) ,
+             ( stat.st_size , stat.st_mtime_ns , fileHash(predImageFile) ) , packed.tobytes() )
+
+# Decode all given masks once and write them to a mask store
+# The masks are referenced relative to rootPath
+def buildMaskStore(maskFileList, storeFile, rootPath, workers=1, verbose=False):
+    maskFileList = sorted(set(maskFileList))
+    if verbose:
+        print("Packing {} prediction masks...".format(len(maskFileList)))
+
+    names = []
+    index = np.zeros( len(maskFileList) , dtype=INDEX_DTYPE )
+    offset = 0
+    results = mapInWorkers(_packMask, maskFileList, workers)
+    # the data is written to a temporary file first, such that an interrupted
+    # build never leaves a data file behind
+    storeDir = os.path.dirname(os.path.abspath(storeFile))
+    (fd,tmpFile) = tempfile.mkstemp(dir=storeDir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for (i,(maskFile,result)) in enumerate(zip(maskFileList,results)):
+                (bbox,shape,pixelCount,fingerprint,data) = result
+                names.append( os.path.relpath(os.path.abspath(maskFile), rootPath) )
+                index[i] = ( offset , ) + bbox + shape + ( pixelCount , ) + fingerprint
+                f.write(data)
+                offset += len(data)
+
+                if verbose:
+                    print("\rMasks Packed: {}".format(i+1), end=' ')
+                    sys.stdout.flush()
+
+        if verbose:
+            print("")
+
+        # the index is replaced first, such that a data file always has an index
+        saveCacheArrays( MaskStore.indexFileName(storeFile) , STORE_VERSION ,
+                         names    = np.array(names, dtype=str) ,
+                         index    = index ,
+                         dataSize = np.array(offset) )
+        os.replace(tmpFile, storeFile)
+    except BaseException:
+        os.unlink(tmpFile)
+        raise
+
+# The mask store in the given file, or None if it is missing, unreadable or
+# of another version, e.g. after an interrupted build
+def loadMaskStore(storeFile, rootPath):
+    try:
+        return MaskStore(storeFile, rootPath)
+    except ValueError:
+        return None
+
+
+# Read access to a mask store
+# The data file is only mapped when a mask is requested, such that the
+# store can be sent to worker processes cheaply.
+class MaskStore(object):
+    def __init__(self, storeFile, rootPath):
+        self.storeFile = storeFile
+        self.rootPath  = rootPath
+        data = loadCacheArrays(self.indexFileName(storeFile), STORE_VERSION, ("names","index","dataSize"))
+        # the index has to belong to the data file next to it
+        if data is None or not os.path.isfile(storeFile) or os.path.getsize(storeFile) != int(data["dataSize"]):
+            raise ValueError("Invalid mask store {}".format(storeFile))
+        self.index = data["index"]
+        self.rows  = dict( (str(name),row) for (row,name) in enumerate(data["names"]) )
+        self._data = None
+
+    @staticmethod
+    def indexFileName(storeFile):
+        return storeFile + ".index.npz"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def _mappedData(self):
+        if self._data is None:
+            if os.path.getsize(self.storeFile) == 0:
+                self._data = np.zeros( 0 , dtype=np.uint8 )
+            else:
+                self._data = np.memmap(self.storeFile, dtype=np.uint8, mode='r')
+        return self._data
+
+    # Check whether a mask file is unchanged since the store was built
+    def _isValid(self, predImageFile, entry):
+        stat = os.stat(predImageFile)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime"]:
+            return True
+        # same size but touched, compare the content
+        if fileHash(predImageFile) != entry["hash"]:
+            return False
+        # the file is not hashed again by this store
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    # The cropped mask, its bounding box and the frame shape, or None if the
+    # mask is not in the store or the file changed since the store was built
+    def getMask(self, predImageFile):
+        name = os.path.relpath(os.path.abspath(predImageFile), self.rootPath)
+        if not name in self.rows:
+            return None
+        entry = self.index[self.rows[name]]
+        if not self._isValid(predImageFile, entry):
+            return None
+
+        bbox = ( int(entry["y0"]) , int(entry["x0"]) , int(entry["y1"]) , int(entry["x1"]) )
+        height = bbox[2] - bbox[0]
+        width  = bbox[3] - bbox[1]
+        rowBytes = (width + 7) // 8
+        start  = int(entry["offset"])
+        packed = self._mappedData()[start:start + height * rowBytes].reshape(height, rowBytes)
+        boolMask = np.unpackbits(packed, axis=1, count=width).view(bool)
+        return (boolMask, bbox, (int(entry["height"]), int(entry["width"])))
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# Cache of the matches of single images, keyed by a hash of their inputs
+#
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+
+# Cityscapes imports
+from .matchTable import GT_DTYPE, PRED_DTYPE, PAIR_DTYPE
+from .helpers.cacheFile import loadCacheArrays, saveCacheArrays
+
+
+# Bump whenever the matching changes, older caches are ignored
+CACHE_VERSION = 1
+
+
+# The rows of every image are stored with image local indices, exactly as
+# returned by assignGt2PredRecords, such that they can be appended to a
+# MatchTableBuilder in any order.
+class MatchCache(object):
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        # key -> (gtRows, predRows, pairRows)
+        self.entries   = {}
+
+    def load(self):
+        names = ("keys","gt","pred","pair","gtOffsets","predOffsets","pairOffsets")
+        data  = loadCacheArrays(self.cacheFile, CACHE_VERSION, names)
+        if data is None:
+            return False
+        keys    = data["keys"]
+        tables  = [ data[name] for name in ("gt","pred","pair") ]
+        offsets = [ data[name + "Offsets"] for name in ("gt","pred","pair") ]
+
+        for (i,key) in enumerate(keys):
+            self.entries[bytes(key)] = tuple( table[offset[i]:offset[i+1]] for (table,offset) in zip(tables,offsets) )
+        return True
+
+    # Write all entries with the given keys, all others are dropped
+    def save(self, keys):
+        keys = sorted(set(keys) & set(self.entries))
+        arrays = {}
+        for (column,(name,dtype)) in enumerate( ( ("gt",GT_DTYPE) , ("pred",PRED_DTYPE) , ("pair",PAIR_DTYPE) ) ):
+            rows    = [ self.entries[key][column] for key in keys ]
+            offsets = np.zeros( len(keys) + 1 , dtype=np.int64 )
+            offsets[1:] = np.cumsum( [ len(r) for r in rows ] )
+            arrays[name] = np.concatenate(rows).astype(dtype) if rows else np.empty(0, dtype=dtype)
+            arrays[name + "Offsets"] = offsets
+
+        saveCacheArrays( self.cacheFile , CACHE_VERSION ,
+                         keys = np.array(keys, dtype="S32") ,
+                         **arrays )
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, rows):
+        self.entries[key] = rows
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+#
+# Columnar representation of the matches between ground truth and predictions
+#
+
+from __future__ import print_function, absolute_import, division
+import numpy as np
+
+
+# One row per ground truth instance
+GT_DTYPE = np.dtype([
+    ("img"              , np.int32  ),
+    ("labelID"          , np.int32  ),
+    ("instID"           , np.int32  ),
+    ("pixelCount"       , np.int64  ),
+    ("medDist"          , np.float64),
+    ("distConf"         , np.float64),
+])
+
+# One row per predicted instance
+PRED_DTYPE = np.dtype([
+    ("img"              , np.int32  ),
+    ("predID"           , np.int32  ),
+    ("labelID"          , np.int32  ),
+    ("pixelCount"       , np.int64  ),
+    ("confidence"       , np.float64),
+    ("voidIntersection" , np.int64  ),
+])
+
+# One row per overlapping pair of ground truth and prediction
+# "gt" and "pred" are row indices into the two tables above
+PAIR_DTYPE = np.dtype([
+    ("gt"               , np.int64  ),
+    ("pred"             , np.int64  ),
+    ("intersection"     , np.int64  ),
+])
+
+
+# All matches of a dataset as three flat tables
+# The image index of a gt or prediction row refers to imgNames
+class MatchTable(object):
+    def __init__(self, imgNames=None, gt=None, pred=None, pair=None):
+        self.imgNames = list(imgNames) if imgNames is not None else []
+        self.gt       = gt   if gt   is not None else np.empty(0, dtype=GT_DTYPE  )
+        self.pred     = pred if pred is not None else np.empty(0, dtype=PRED_DTYPE)
+        self.pair     = pair if pair is not None else np.empty(0, dtype=PAIR_DTYPE)
+
+    # Flatten the nested dictionary created by matchGtWithPreds
+    @classmethod
+    def fromMatches(cls, matches):
+        imgNames = []
+        gtRows   = []
+        predRows = []
+        pairRows = []
+        for (imgIdx,imgName) in enumerate(matches):
+            imgNames.append(imgName)
+            gtRowOfInst = {}
+            for labelName in matches[imgName]["groundTruth"]:
+                for gt in matches[imgName]["groundTruth"][labelName]:
+                    gtRowOfInst[gt["instID"]] = len(gtRows)
+                    gtRows.append( ( imgIdx , gt["labelID"] , gt["instID"] , gt["pixelCount"] , gt["medDist"] , gt["distConf"] ) )
+            for labelName in matches[imgName]["prediction"]:
+                for pred in matches[imgName]["prediction"][labelName]:
+                    predRow = len(predRows)
+                    predRows.append( ( imgIdx , pred["predID"] , pred["labelID"] , pred["pixelCount"] , pred["confidence"] , pred["voidIntersection"] ) )
+                    for gt in pred["matchedGt"]:
+                        pairRows.append( ( gtRowOfInst[gt["instID"]] , predRow , gt["intersection"] ) )
+
+        return cls( imgNames ,
+                    np.array(gtRows  , dtype=GT_DTYPE  ) ,
+                    np.array(predRows, dtype=PRED_DTYPE) ,
+                    np.array(pairRows, dtype=PAIR_DTYPE) )
+
+    # The matches of the images with the given indices, in that order of images
+    # The rows keep their order, the image and row indices are renumbered
+    def selectImages(self, imgIndices):
+        imgIndices = np.asarray(imgIndices, dtype=np.int64)
+        imgMap = np.full( len(self.imgNames) , -1 , dtype=np.int64 )
+        imgMap[imgIndices] = np.arange(len(imgIndices))
+
+        gtKept   = imgMap[self.gt  ["img"]] >= 0
+        predKept = imgMap[self.pred["img"]] >= 0
+        # new index of every kept row
+        gtMap    = np.cumsum(gtKept  ) - 1
+        predMap  = np.cumsum(predKept) - 1
+
+        gt   = self.gt  [gtKept  ]
+        pred = self.pred[predKept]
+        pair = self.pair[ gtKept[self.pair["gt"]] ]
+        gt  ["img"]  = imgMap[gt  ["img"]]
+        pred["img"]  = imgMap[pred["img"]]
+        pair["gt"]   = gtMap  [pair["gt"  ]]
+        pair["pred"] = predMap[pair["pred"]]
+        return MatchTable( [ self.imgNames[i] for i in imgIndices ] , gt , pred , pair )
+
+    # Store the tables in a single npz file
+    def save(self, fileName):
+        with open(fileName, 'wb') as f:
+            np.savez_compressed( f ,
+                                 imgNames = np.array(self.imgNames, dtype=str) ,
+                                 gt       = self.gt ,
+                                 pred     = self.pred ,
+                                 pair     = self.pair )
+
+    @classmethod
+    def load(cls, fileName):
+        with np.load(fileName, allow_pickle=False) as data:
+            return cls( [ str(name) for name in data["imgNames"] ] ,
+                        data["gt"  ].astype(GT_DTYPE  ) ,
+                        data["pred"].astype(PRED_DTYPE) ,
+                        data["pair"].astype(PAIR_DTYPE) )
+
+
+# Collects the rows of many images into preallocated tables
+# The tables grow by doubling their capacity, such that appending an image
+# costs time proportional to its number of rows.
+class MatchTableBuilder(object):
+    def __init__(self, nbImages=0):
+        self.imgNames = []
+        # start with room for a few instances per image
+        capacity      = max( 16 , 4 * nbImages )
+        self.gt       = np.empty( capacity , dtype=GT_DTYPE   )
+        self.pred     = np.empty( capacity , dtype=PRED_DTYPE )
+        self.pair     = np.empty( capacity , dtype=PAIR_DTYPE )
+        self.nbGt     = 0
+        self.nbPred   = 0
+        self.nbPair   = 0
+
+    @staticmethod
+    def _reserve(table, used, needed):
+        if used + needed <= len(table):
+            return table
+        grown = np.empty( max( 2 * len(table) , used + needed ) , dtype=table.dtype )
+        grown[:used] = table[:used]
+        return grown
+
+    # Add the rows of a single image
+    # The image and row indices of the given rows refer to that image alone.
+    def append(self, imgName, gtRows, predRows, pairRows):
+        imgIdx = len(self.imgNames)
+        self.imgNames.append(imgName)
+
+        self.gt   = self._reserve(self.gt  , self.nbGt  , len(gtRows  ))
+        self.pred = self._reserve(self.pred, self.nbPred, len(predRows))
+        self.pair = self._reserve(self.pair, self.nbPair, len(pairRows))
+
+        gtSlice   = slice( self.nbGt   , self.nbGt   + len(gtRows  ) )
+        predSlice = slice( self.nbPred , self.nbPred + len(predRows) )
+        pairSlice = slice( self.nbPair , self.nbPair + len(pairRows) )
+
+        self.gt  [gtSlice  ] = gtRows
+        self.gt  [gtSlice  ]["img"]  = imgIdx
+        self.pred[predSlice] = predRows
+        self.pred[predSlice]["img"]  = imgIdx
+        self.pair[pairSlice] = pairRows
+        self.pair[pairSlice]["gt"]   += self.nbGt
+        self.pair[pairSlice]["pred"] += self.nbPred
+
+        self.nbGt   += len(gtRows  )
+        self.nbPred += len(predRows)
+        self.nbPair += len(pairRows)
+
+    def build(self):
+        return MatchTable( self.imgNames ,
+                           self.gt  [:self.nbGt  ].copy() ,
+                           self.pred[:self.nbPred].copy() ,
+                           self.pair[:self.nbPair].copy() )
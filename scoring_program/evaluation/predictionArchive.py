@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# Read access to predictions inside a zip archive, without extracting it
+#
+
+from __future__ import print_function, absolute_import, division
+import io
+import os
+import hashlib
+import zipfile
+
+
+# The members of the archive are addressed by virtual paths, i.e. the path
+# of the archive joined with the name of the member, such that they can be
+# handled like the files of an extracted submission:
+#   /path/to/submission.zip/fishyscapes/image_000000_000000_pred.txt
+# The archive is only opened when a member is read. The handle is bound to
+# the process that opened it, every worker process opens its own handle.
+class PredictionArchive(object):
+    def __init__(self, archiveFile):
+        self.archiveFile = os.path.abspath(archiveFile)
+        self._handle     = None
+        self._pid        = None
+        with zipfile.ZipFile(self.archiveFile) as archive:
+            self.infos = dict( (info.filename,info) for info in archive.infolist() if not info.is_dir() )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_handle"] = None
+        state["_pid"]    = None
+        return state
+
+    def _archive(self):
+        # a forked process must not share the file position of its parent
+        if self._handle is None or self._pid != os.getpid():
+            self._handle = zipfile.ZipFile(self.archiveFile)
+            self._pid    = os.getpid()
+        return self._handle
+
+    # Name of the member for a virtual path, or None if it is outside of the archive
+    def memberName(self, fileName):
+        relPath = os.path.relpath(os.path.abspath(fileName), self.archiveFile)
+        if relPath in (os.curdir, os.pardir) or relPath.startswith(os.pardir + os.sep):
+            return None
+        return relPath.replace(os.sep, "/")
+
+    # Virtual path of a member
+    def fileName(self, memberName):
+        return os.path.join(self.archiveFile, *memberName.split("/"))
+
+    def isfile(self, fileName):
+        return self.memberName(fileName) in self.infos
+
+    # All members below the given virtual path, grouped by their folder
+    # in the format of [ (root, filenames) ] as collected from os.walk
+    def walk(self, rootPath):
+        prefix = self.memberName(rootPath)
+        prefix = prefix + "/" if prefix else ""
+        folders = {}
+        for memberName in sorted(self.infos):
+            if not memberName.startswith(prefix):
+                continue
+            (folder,_,filename) = memberName.rpartition("/")
+            folders.setdefault(folder, []).append(filename)
+        return [ ( self.fileName(folder) if folder else self.archiveFile , filenames ) for (folder,filenames) in sorted(folders.items()) ]
+
+    # Open a member for reading in binary mode
+    # Stored members are read straight from the archive, which can seek in
+    # them cheaply. Compressed members are decompressed into memory once,
+    # since every seek backwards would decompress them from the start again.
+    def open(self, fileName):
+        memberName = self.memberName(fileName)
+        if not memberName in self.infos:
+            raise FileNotFoundError("No member {} in {}".format(memberName, self.archiveFile))
+        info = self.infos[memberName]
+        if info.compress_type == zipfile.ZIP_STORED:
+            return self._archive().open(info)
+        with self._archive().open(info) as f:
+            return io.BytesIO(f.read())
+
+    # Same hash as csHelpers.fileHash, computed on the content of a member
+    def fileHash(self, fileName):
+        h = hashlib.blake2b(digest_size=16)
+        with self.open(fileName) as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest().encode("ascii")
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Run-length encoded masks in the format of the COCO API
+#
+
+from __future__ import print_function, absolute_import, division
+import numpy as np
+
+
+# A mask of size [height, width] is encoded by the lengths of alternating
+# runs of zeros and ones, starting with zeros, in column-major order.
+# The counts are given either as a list of integers or as the compressed
+# string written by pycocotools, where every count is stored in chunks of
+# five bits, offset by 48 to be printable, and all but the first two counts
+# are stored as difference to the count two positions before.
+def decodeCounts(counts):
+    if not isinstance(counts, str):
+        return np.asarray(counts, dtype=np.int64)
+
+    decoded = []
+    p = 0
+    while p < len(counts):
+        x    = 0
+        k    = 0
+        more = True
+        while more:
+            c    = ord(counts[p]) - 48
+            x   |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p   += 1
+            k   += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(decoded) > 2:
+            x += decoded[-2]
+        decoded.append(x)
+    return np.array(decoded, dtype=np.int64)
+
+# The runs of ones of an encoded mask as start indices and lengths in the
+# column-major flattened frame, empty runs are dropped
+def foregroundRuns(rle):
+    (height,width) = rle["size"]
+    counts = decodeCounts(rle["counts"])
+    if np.any(counts < 0) or counts.sum() != height * width:
+        raise ValueError("Run lengths do not cover a frame of size {}".format(rle["size"]))
+    ends    = np.cumsum(counts)
+    starts  = ends - counts
+    lengths = counts[1::2]
+    starts  = starts[1::2]
+    nonEmpty = lengths > 0
+    return ( starts[nonEmpty] , lengths[nonEmpty] )
+
+# Bounding box (y0,x0,y1,x1) of the given runs in a frame of the given height
+# A run that continues into the next column covers all rows of the box
+def runsBoundingBox(starts, lengths, height):
+    if not len(starts):
+        return (0,0,0,0)
+    ends = starts + lengths - 1
+    (firstCols,firstRows) = np.divmod(starts, height)
+    (lastCols ,lastRows ) = np.divmod(ends  , height)
+    singleCol = firstCols == lastCols
+    y0 = int(firstRows[singleCol].min()) if singleCol.all() else 0
+    y1 = int(lastRows [singleCol].max()) + 1 if singleCol.all() else height
+    return ( y0 , int(firstCols.min()) , y1 , int(lastCols.max()) + 1 )
+
+# Indices of all pixels covered by the given runs
+def runIndices(starts, lengths):
+    total = int(lengths.sum())
+    # index within the concatenated runs, shifted to the start of each run
+    runOffsets = np.cumsum(lengths) - lengths
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - runOffsets, lengths)
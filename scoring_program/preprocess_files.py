@@ -1,47 +1,85 @@
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List
 import shutil
 import os
+import time
 
+from evaluation.instrumentation import recordStage
 
-def prepare_submitted_files(submission_path: Path, temp_folder: Path) -> None:
+
+def prepare_submitted_files(
+    submission_path: Path, temp_folder: Path, workers: int = 8
+) -> None:
+    start = time.perf_counter()
     input_folder = temp_folder
     input_folder.mkdir(exist_ok=True)
 
+    # list the submission once, the png files of a scene start with its name
+    png_names = sorted(path.name for path in submission_path.glob("*.png"))
 
     files_list = sorted(list(submission_path.glob("*.txt")))
-    for submission_file in files_list:
-        label_class = 26 # car, for an easier compute
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # consume the results, such that errors are raised here
+        list(
+            executor.map(
+                lambda submission_file: prepare_scene(
+                    submission_file, png_names, input_folder
+                ),
+                files_list,
+            )
+        )
+    recordStage("prepare_submitted_files", time.perf_counter() - start, len(files_list))
+
+
+def find_scene_files(png_names: List[str], scene_name: str) -> List[str]:
+    # all names starting with the scene name are adjacent in the sorted list
+    scene_files = []
+    i = bisect_left(png_names, scene_name)
+    while i < len(png_names) and png_names[i].startswith(scene_name):
+        scene_files.append(png_names[i])
+        i += 1
+    return scene_files
+
 
-        scene_name = "_".join((submission_file.name).split("_")[:-2])
-        predictions = list(submission_file.parent.glob(f"{scene_name}*.png"))
-        for prediction in predictions:
-            # change the class to 26
+def prepare_scene(
+    submission_file: Path, png_names: List[str], input_folder: Path
+) -> None:
+    label_class = 26 # car, for an easier compute
+
+    scene_name = "_".join((submission_file.name).split("_")[:-2])
+    predictions = [
+        submission_file.parent / name for name in find_scene_files(png_names, scene_name)
+    ]
+    for prediction in predictions:
+        # change the class to 26
+        new_filename = (
+            "_".join(prediction.name.split("_")[:-1]) + f"_{label_class}.png"
+        )
+        new_filepath = str(input_folder / new_filename)
+        shutil.copy(str(prediction), new_filepath)
+        os.chmod(new_filepath, 0o755)
+
+    prediction_list = []
+    with open(submission_file, "r") as f:
+        lines = f.read().strip().split("\n")
+        for line in lines:
+            prediction_list.append(line.split(" "))
+
+    if (len(prediction_list) == 1) and (len(prediction_list[0]) == 1):
+        raise FileNotFoundError(
+            f"""No prediction found in {submission_file.name} file.
+        Please provide at least one predicted instance.
+        """
+        )
+        # no predictions for a file
+
+    # rewrite the file
+    new_submission_file = submission_file.name
+    with open(input_folder / new_submission_file, "w") as f:
+        for prediction in prediction_list:
             new_filename = (
-                "_".join(prediction.name.split("_")[:-1]) + f"_{label_class}.png"
-            )
-            new_filepath = str(input_folder / new_filename)
-            shutil.copy(str(prediction), new_filepath)
-            os.chmod(new_filepath, 0o755)
-
-        prediction_list = []
-        with open(submission_file, "r") as f:
-            lines = f.read().strip().split("\n")
-            for line in lines:
-                prediction_list.append(line.split(" "))
-
-        if (len(prediction_list) == 1) and (len(prediction_list[0]) == 1):
-            raise FileNotFoundError(
-                f"""No prediction found in {submission_file.name} file.
-            Please provide at least one predicted instance.
-            """
+                "_".join(prediction[0].split("_")[:-1]) + f"_{label_class}.png"
             )
-            # no predictions for a file
-
-        # rewrite the file
-        new_submission_file = submission_file.name
-        with open(input_folder / new_submission_file, "w") as f:
-            for prediction in prediction_list:
-                new_filename = (
-                    "_".join(prediction[0].split("_")[:-1]) + f"_{label_class}.png"
-                )
-                f.write(f"{new_filename} {label_class} {prediction[-1]}\n")
+            f.write(f"{new_filename} {label_class} {prediction[-1]}\n")
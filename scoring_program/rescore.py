@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+from __future__ import print_function, absolute_import, division
+import argparse
+from pathlib import Path
+import numpy as np
+
+import evaluation.evalInstanceLevelSemanticLabeling as cityscapes_eval
+
+
+def main(
+    matches_path,
+    output_path,
+    overlaps=None,
+    min_region_sizes=None,
+    distance_thresholds=None,
+    distance_confs=None,
+):
+    output_path = Path(output_path)
+    if not output_path.exists():
+        output_path.mkdir()
+    output_filename = output_path / "scores.txt"
+
+    # same settings as evaluate.py, unless overridden
+    args = cityscapes_eval.args._replace(
+        JSONOutput=False,
+        colorized=False,
+        quiet=True,
+        minRegionSizes=np.array([10, 10, 10]),
+    )
+    if overlaps is not None:
+        args = args._replace(overlaps=np.array(overlaps))
+    if min_region_sizes is not None:
+        args = args._replace(minRegionSizes=np.array(min_region_sizes))
+    if distance_thresholds is not None or distance_confs is not None:
+        args = args._replace(distanceAvailable=True)
+        if distance_thresholds is not None:
+            args = args._replace(distanceThs=np.array(distance_thresholds))
+        if distance_confs is not None:
+            args = args._replace(distanceConfs=np.array(distance_confs))
+
+    results = cityscapes_eval.evaluateMatchesFile(str(matches_path), args)["averages"]
+
+    ret = {
+        "AP": results["allAp"] * 100,
+        "AP50": results["allAp50%"] * 100,
+    }
+    with open(output_filename, "w") as file:
+        for k, v in ret.items():
+            file.write(f"{k}: {v}\n")
+    print(ret)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute the scores from matches stored by evaluate.py --save_matches"
+    )
+
+    parser.add_argument("matches_path", help="Path to the matches.npz file")
+    parser.add_argument("output_path", help="Path to the output file")
+    parser.add_argument("--overlaps", type=float, nargs="+", help="Overlap thresholds")
+    parser.add_argument("--min_region_sizes", type=int, nargs="+", help="Minimum region sizes in pixels")
+    parser.add_argument("--distance_thresholds", type=float, nargs="+", help="Distance thresholds in meters")
+    parser.add_argument("--distance_confs", type=float, nargs="+", help="Distance confidences")
+
+    args = parser.parse_args()
+    main(
+        args.matches_path,
+        args.output_path,
+        overlaps=args.overlaps,
+        min_region_sizes=args.min_region_sizes,
+        distance_thresholds=args.distance_thresholds,
+        distance_confs=args.distance_confs,
+    )
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the scoring scripts import the evaluation package from their own folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,26 @@
+import contextlib
+import io
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from evaluation.boxEvaluation import BoxDataset, BoxEval
+
+# Ground truth with crowd boxes and two categories and the detections of
+# three cases, with the 12 stats computed by COCOeval of pycocotools 2.0.7
+FIXTURES = Path(__file__).parent / "fixtures" / "box_evaluation"
+EXPECTED = json.loads((FIXTURES / "expected_stats.json").read_text())["stats"]
+
+
+@pytest.mark.parametrize("case", sorted(EXPECTED))
+def test_stats_match_pycocotools(case):
+    cocoGt = BoxDataset.fromFile(FIXTURES / f"{case}_gt.json")
+    cocoDt = cocoGt.loadRes(FIXTURES / f"{case}_detections.json")
+    cocoEval = BoxEval(cocoGt, cocoDt)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cocoEval.evaluate()
+        cocoEval.accumulate()
+        cocoEval.summarize()
+    np.testing.assert_array_equal(cocoEval.stats, EXPECTED[case])